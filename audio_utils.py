@@ -0,0 +1,99 @@
+import os
+import asyncio
+import logging
+from config import Config
+from metrics_utils import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# Output extension and ffmpeg codec arguments for each transcoded format
+AUDIO_CODECS = {
+    'mp3': ('mp3', ['-c:a', 'libmp3lame', '-b:a', '192k']),
+    'wav': ('wav', ['-c:a', 'pcm_s16le']),
+    # Lossless like WAV but roughly half the size to store and upload
+    'flac': ('flac', ['-c:a', 'flac', '-compression_level', '8']),
+}
+
+# Containers YouTube serves that Telegram can play without re-encoding
+NATIVE_EXTENSIONS = {'m4a', 'opus', 'ogg', 'mp3', 'aac'}
+
+# Container a stream of each codec is copied into when it arrives in WebM/MKV
+CODEC_EXTENSIONS = {
+    'opus': 'opus',
+    'aac': 'm4a',
+    'mp3': 'mp3',
+    'vorbis': 'ogg',
+    'flac': 'flac',
+}
+# Matroska audio holds any codec, for the ones not listed above
+FALLBACK_NATIVE_EXTENSION = 'mka'
+
+# Bounds how many ffmpeg encoders run at once (defaults to one per core)
+transcode_slots = asyncio.Semaphore(max(1, Config.TRANSCODE_WORKERS))
+
+async def audio_codec(file_path):
+    """Codec name of the first audio stream in a file, or None if ffprobe can't tell"""
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name', '-of', 'default=noprint_wrappers=1:nokey=1', file_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await process.communicate()
+    return stdout.decode().strip() or None
+
+async def transcode_audio(file_path, format_type):
+    """Transcode a downloaded audio stream into the requested format.
+
+    'native' keeps the original stream and only remuxes WebM audio into the
+    container that matches its codec. Returns the path of the resulting
+    file, or None on failure.
+    """
+    source_ext = os.path.splitext(file_path)[1].lstrip('.').lower()
+
+    if format_type == 'native':
+        if source_ext in NATIVE_EXTENSIONS:
+            return file_path
+        # The stream is copied as-is, into a container that can hold its codec
+        codec = await audio_codec(file_path)
+        target_ext = CODEC_EXTENSIONS.get(codec, FALLBACK_NATIVE_EXTENSION)
+        codec_args = ['-c:a', 'copy']
+    else:
+        target_ext, codec_args = AUDIO_CODECS[format_type]
+
+    if source_ext == target_ext:
+        return file_path
+
+    output_path = os.path.splitext(file_path)[0] + f".{target_ext}"
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', file_path,
+        '-vn', *codec_args,
+        output_path
+    ]
+
+    async with transcode_slots:
+        with stage_seconds.time(stage='transcode'):
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                # Don't leave an orphaned encoder running after a cancel
+                process.kill()
+                await process.wait()
+                raise
+
+    if process.returncode != 0:
+        logger.error(f"Error transcoding {file_path} to {format_type}: {stderr.decode().strip()}")
+        return None
+
+    # The original stream is no longer needed once it has been encoded
+    try:
+        os.remove(file_path)
+    except OSError as e:
+        logger.error(f"Error removing source audio {file_path}: {str(e)}")
+
+    return output_path
@@ -0,0 +1,129 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Bytes per second in one Mbps, link caps are configured in Mbps like the meters
+MBPS = 1000 * 1000 / 8
+
+INGRESS = 'in'
+EGRESS = 'out'
+
+class Transfer:
+    """One job's share of the ingress or egress link.
+
+    ``rate`` is kept up to date by the BandwidthManager as jobs come and go,
+    0 means unlimited. Downloads read it through get() (split over the job's
+    parallel streams), uploads pace themselves with delay().
+    """
+
+    def __init__(self, job_id, priority):
+        self.job_id = job_id
+        self.priority = priority
+        self.rate = 0
+        self.streams = 0
+        self._position = 0
+        self._due = 0
+
+    def get(self):
+        """Bytes per second each of the job's open streams may use, 0 for no limit"""
+        if not self.rate:
+            return 0
+        return self.rate / max(1, self.streams)
+
+    @contextmanager
+    def stream(self):
+        """Count a stream of this job for as long as it is transferring"""
+        self.streams += 1
+        try:
+            yield self
+        finally:
+            self.streams -= 1
+
+    def delay(self, position):
+        """Seconds to wait so the transfer stays under its rate.
+
+        ``position`` is the number of bytes of the current file sent so far,
+        a smaller value than last time means a new file has started.
+        """
+        if position < self._position:
+            self._position = 0
+        sent = position - self._position
+        self._position = position
+        if not self.rate:
+            return 0
+
+        now = time.monotonic()
+        # Idle time isn't saved up, so a paused transfer can't burst afterwards
+        self._due = max(self._due, now) + sent / self.rate
+        return max(0, self._due - now)
+
+class BandwidthManager:
+    """Divides configured ingress and egress caps among active jobs.
+
+    Each direction's cap is shared by weight: jobs small enough to count as
+    interactive get a much larger weight than bulk jobs, so a few MP3s finish
+    quickly while a 4K playlist soaks up whatever is left. Shares are
+    rebalanced whenever a transfer starts or finishes.
+    """
+
+    def __init__(self, ingress=0, egress=0, interactive_bytes=0, weights=None):
+        self.caps = {INGRESS: ingress, EGRESS: egress}
+        self.interactive_bytes = interactive_bytes
+        self.weights = weights or {'interactive': 1, 'bulk': 1}
+        self.transfers = {INGRESS: {}, EGRESS: {}}
+        self.job_sizes = {}
+        self._lock = threading.Lock()
+
+    def priority(self, job_id):
+        """'interactive' for jobs known to be small, 'bulk' otherwise"""
+        size = self.job_sizes.get(job_id)
+        if size is not None and size <= self.interactive_bytes:
+            return 'interactive'
+        return 'bulk'
+
+    def set_job_size(self, job_id, nbytes):
+        """Record a job's expected size, which decides its priority"""
+        with self._lock:
+            self.job_sizes[job_id] = nbytes
+            for direction, transfers in self.transfers.items():
+                if job_id in transfers:
+                    transfers[job_id].priority = self.priority(job_id)
+                    self._rebalance(direction)
+
+    def _rebalance(self, direction):
+        cap = self.caps[direction]
+        transfers = list(self.transfers[direction].values())
+        total_weight = sum(self.weights[t.priority] for t in transfers)
+        for t in transfers:
+            t.rate = cap * self.weights[t.priority] / total_weight if cap else 0
+
+    @contextmanager
+    def transfer(self, direction, job_id):
+        """Register a job as active in one direction for the duration of the block"""
+        with self._lock:
+            transfer = Transfer(job_id, self.priority(job_id))
+            self.transfers[direction][job_id] = transfer
+            self._rebalance(direction)
+        try:
+            yield transfer
+        finally:
+            with self._lock:
+                if self.transfers[direction].get(job_id) is transfer:
+                    del self.transfers[direction][job_id]
+                self._rebalance(direction)
+
+    def get(self, direction, job_id):
+        """The job's active transfer in that direction, or None"""
+        return self.transfers[direction].get(job_id)
+
+bandwidth = BandwidthManager(
+    ingress=Config.PROCESS_INGRESS_MBPS * MBPS,
+    egress=Config.PROCESS_EGRESS_MBPS * MBPS,
+    interactive_bytes=Config.INTERACTIVE_JOB_MB * MB,
+    weights={'interactive': Config.INTERACTIVE_WEIGHT, 'bulk': Config.BULK_WEIGHT},
+)
@@ -12,4 +12,96 @@ class Config:
     OWNER_ID = int(os.getenv("OWNER_ID"))
     UPLOAD_INTERVAL = int(os.getenv("UPLOAD_INTERVAL"))
     ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
-    LOG_CHANNEL = int(os.getenv("LOG_CHANNEL"))
\ No newline at end of file
+    LOG_CHANNEL = int(os.getenv("LOG_CHANNEL"))
+    # Processes used to deflate compressible ZIP members (defaults to all cores)
+    ZIP_WORKERS = int(os.getenv("ZIP_WORKERS", os.cpu_count() or 1))
+    # Concurrent ffmpeg audio encoders (defaults to all cores)
+    TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", os.cpu_count() or 1))
+    # Highest resolution the automatic quality mode will pick
+    AUTO_QUALITY_CAP = int(os.getenv("AUTO_QUALITY_CAP", 1080))
+    # Disk space jobs may reserve in downloads/ (0 = free space at startup minus headroom)
+    SCRATCH_BUDGET_GB = float(os.getenv("SCRATCH_BUDGET_GB", 0))
+    # Largest footprint a single user may hold at once (0 = no quota)
+    USER_QUOTA_GB = float(os.getenv("USER_QUOTA_GB", 0))
+    DISK_HEADROOM_GB = float(os.getenv("DISK_HEADROOM_GB", 1))
+    # Assumed link speeds for estimates until real transfers have been measured
+    DEFAULT_DOWNLOAD_MBPS = float(os.getenv("DEFAULT_DOWNLOAD_MBPS", 50))
+    DEFAULT_UPLOAD_MBPS = float(os.getenv("DEFAULT_UPLOAD_MBPS", 20))
+    # Longest a single background job may run before it is stopped (0 = no limit)
+    JOB_TIMEOUT_HOURS = float(os.getenv("JOB_TIMEOUT_HOURS", 12))
+    # Attempts per entry and the exponential backoff between them (seconds)
+    DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", 4))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 5))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 120))
+    # Throttling errors in a row that pause all extraction, and for how long (seconds)
+    THROTTLE_THRESHOLD = int(os.getenv("THROTTLE_THRESHOLD", 3))
+    THROTTLE_COOLDOWN = int(os.getenv("THROTTLE_COOLDOWN", 300))
+    # How cookie sets are rotated (round_robin or least_throttled) and how long
+    # a throttled set sits out (seconds)
+    COOKIE_STRATEGY = os.getenv("COOKIE_STRATEGY", "round_robin")
+    COOKIE_QUARANTINE = int(os.getenv("COOKIE_QUARANTINE", 1800))
+    # Comma separated outbound routes for yt-dlp: proxy URLs, "source:<local ip>"
+    # or "direct" (empty = direct only), and how many transfers each may carry
+    PROXIES = os.getenv("PROXIES", "")
+    PROXY_CONCURRENCY = int(os.getenv("PROXY_CONCURRENCY", 3))
+    PROXY_FAILURE_THRESHOLD = int(os.getenv("PROXY_FAILURE_THRESHOLD", 3))
+    PROXY_COOLDOWN = int(os.getenv("PROXY_COOLDOWN", 600))
+    # Long-lived yt-dlp download processes and the separate ones for metadata
+    # extraction (0 = run that part in the bot process), and the cache
+    # directory they keep warm (empty = yt-dlp's default)
+    EXTRACTOR_WORKERS = int(os.getenv("EXTRACTOR_WORKERS", min(4, os.cpu_count() or 1)))
+    PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", 2))
+    YTDLP_CACHE_DIR = os.getenv("YTDLP_CACHE_DIR", "cache/yt-dlp")
+    # Download connections all jobs may open together and a single job may hold
+    # (split between the video and audio streams when they are fetched in parallel)
+    DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", 32))
+    DOWNLOAD_CONNECTIONS_PER_JOB = int(os.getenv("DOWNLOAD_CONNECTIONS_PER_JOB", 8))
+    PARALLEL_STREAMS = os.getenv("PARALLEL_STREAMS", "true").lower() == "true"
+    # Multi-connection downloader to use instead of yt-dlp's own ("aria2c" or empty)
+    EXTERNAL_DOWNLOADER = os.getenv("EXTERNAL_DOWNLOADER", "")
+    # Link caps shared by all jobs in Mbps (0 = unlimited), jobs up to
+    # INTERACTIVE_JOB_MB get INTERACTIVE_WEIGHT shares for every BULK_WEIGHT share of bigger ones
+    INGRESS_MBPS = float(os.getenv("INGRESS_MBPS", 0))
+    EGRESS_MBPS = float(os.getenv("EGRESS_MBPS", 0))
+    INTERACTIVE_JOB_MB = float(os.getenv("INTERACTIVE_JOB_MB", 500))
+    INTERACTIVE_WEIGHT = float(os.getenv("INTERACTIVE_WEIGHT", 8))
+    BULK_WEIGHT = float(os.getenv("BULK_WEIGHT", 1))
+    # Download jobs running at once (0 = no limit), waiting jobs go cheapest first
+    # and a waiting job's cost halves every JOB_AGING_MINUTES so big ones still run
+    MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 3))
+    JOB_AGING_MINUTES = float(os.getenv("JOB_AGING_MINUTES", 10))
+    # Comma separated user IDs whose jobs are scheduled right after the owner's
+    ADMIN_IDS = {int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
+    # SQLite file holding authorized users, sessions and job records, how long an
+    # idle session (and per-message upload state) is kept, and days of job history
+    STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+    SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", 24))
+    JOB_HISTORY_DAYS = float(os.getenv("JOB_HISTORY_DAYS", 30))
+    # SQLite job queue shared with worker processes (empty = run jobs in the bot
+    # process), how many workers the bot starts on this machine, jobs each worker
+    # runs at once and seconds without a heartbeat before a worker's job is requeued
+    JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "")
+    LOCAL_WORKERS = int(os.getenv("LOCAL_WORKERS", 2))
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 2))
+    QUEUE_LEASE = int(os.getenv("QUEUE_LEASE", 120))
+    # Set by worker.py for worker processes
+    WORKER_ID = os.getenv("WORKER_ID", "")
+    # Set by the bot for the workers it starts: the machine's scratch space, link
+    # caps, download connections and download slots are split between this many
+    WORKER_SHARE = max(1, int(os.getenv("WORKER_SHARE", 1)))
+    # This process's part of those machine-wide limits (0 stays unlimited)
+    PROCESS_SCRATCH_BUDGET_GB = SCRATCH_BUDGET_GB / WORKER_SHARE
+    PROCESS_INGRESS_MBPS = INGRESS_MBPS / WORKER_SHARE
+    PROCESS_EGRESS_MBPS = EGRESS_MBPS / WORKER_SHARE
+    PROCESS_DOWNLOAD_CONNECTIONS = max(1, DOWNLOAD_CONNECTIONS // WORKER_SHARE) if DOWNLOAD_CONNECTIONS else 0
+    PROCESS_CONCURRENT_JOBS = max(1, MAX_CONCURRENT_JOBS // WORKER_SHARE) if MAX_CONCURRENT_JOBS else 0
+    # Log channel events are sent as a digest every LOG_DIGEST_INTERVAL seconds,
+    # at most LOG_QUEUE_SIZE wait in between (routine ones are sampled or dropped first)
+    LOG_DIGEST_INTERVAL = float(os.getenv("LOG_DIGEST_INTERVAL", 30))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 200))
+    # Hours a user's name is cached for mentions in messages and logs
+    PROFILE_TTL_HOURS = float(os.getenv("PROFILE_TTL_HOURS", 6))
+    # Port of the local Prometheus metrics endpoint (0 = off), local workers use
+    # the ports right after it. Bound to METRICS_HOST, localhost by default
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
@@ -0,0 +1,104 @@
+import os
+import time
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Extra cookie sets added with /addcookies live here, cookies.txt stays the default
+COOKIES_DIR = "cookies"
+DEFAULT_COOKIE_FILE = "cookies.txt"
+
+class CookiePool:
+    """Spreads yt-dlp extraction across several accounts' cookie files.
+
+    Files are handed out round-robin or least-recently-throttled first. A
+    cookie set that hits a bot check or 429 is quarantined for a while, so
+    the remaining accounts carry the load until it cools down.
+    """
+
+    def __init__(self, directory, default_file=None, strategy='round_robin', quarantine=1800):
+        self.directory = directory
+        self.default_file = default_file
+        self.strategy = strategy
+        self.quarantine = quarantine
+        self.quarantined_until = {}
+        self.last_throttled = {}
+        self.uses = {}
+        self._next = 0
+
+    def files(self):
+        """All cookie files currently in the pool"""
+        files = []
+        if self.default_file and os.path.exists(self.default_file):
+            files.append(self.default_file)
+        if os.path.isdir(self.directory):
+            files.extend(
+                os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))
+                if name.endswith('.txt')
+            )
+        return files
+
+    def is_quarantined(self, path):
+        return self.quarantined_until.get(path, 0) > time.time()
+
+    def acquire(self):
+        """Pick the cookie file for the next extraction, or None to go without cookies"""
+        files = self.files()
+        if not files:
+            return None
+
+        available = [path for path in files if not self.is_quarantined(path)]
+        if not available:
+            # Everything is cooling down, use whichever set recovers first
+            path = min(files, key=lambda f: self.quarantined_until.get(f, 0))
+        elif self.strategy == 'least_throttled':
+            path = min(available, key=lambda f: (self.last_throttled.get(f, 0), self.uses.get(f, 0)))
+        else:
+            path = available[self._next % len(available)]
+            self._next += 1
+
+        self.uses[path] = self.uses.get(path, 0) + 1
+        return path
+
+    def report_throttle(self, path):
+        """Quarantine a cookie set that YouTube started challenging"""
+        if not path:
+            return
+        now = time.time()
+        self.last_throttled[path] = now
+        self.quarantined_until[path] = now + self.quarantine
+        logger.warning(f"Cookie file {path} is being throttled, quarantined for {self.quarantine}s")
+
+    def _path(self, name):
+        """Path of a named cookie set, the name can't leave the pool directory"""
+        safe_name = "".join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        return os.path.join(self.directory, f"{safe_name}.txt")
+
+    def add(self, name, content):
+        """Save a cookie set to the pool, returns its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.quarantined_until.pop(path, None)
+        return path
+
+    def remove(self, name):
+        """Delete a cookie set from the pool, returns False if it doesn't exist"""
+        path = self._path(name)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        self.quarantined_until.pop(path, None)
+        self.last_throttled.pop(path, None)
+        self.uses.pop(path, None)
+        return True
+
+cookie_pool = CookiePool(
+    COOKIES_DIR,
+    default_file=DEFAULT_COOKIE_FILE,
+    strategy=Config.COOKIE_STRATEGY,
+    quarantine=Config.COOKIE_QUARANTINE,
+)
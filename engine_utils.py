@@ -0,0 +1,86 @@
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# External downloaders we know how to drive with multiple connections
+EXTERNAL_DOWNLOADERS = {'aria2c'}
+
+def external_downloader():
+    """The configured external downloader, or None to use yt-dlp's own"""
+    name = Config.EXTERNAL_DOWNLOADER
+    if not name:
+        return None
+    if name not in EXTERNAL_DOWNLOADERS:
+        logger.warning(f"Unsupported external downloader {name}, using yt-dlp's own")
+        return None
+    if not shutil.which(name):
+        logger.warning(f"External downloader {name} is not installed, using yt-dlp's own")
+        return None
+    return name
+
+def engine_opts(connections):
+    """yt-dlp options for downloading one stream over the given number of connections"""
+    connections = max(1, connections)
+    opts = {'concurrent_fragment_downloads': connections}
+    downloader = external_downloader()
+    if downloader == 'aria2c':
+        opts['external_downloader'] = {'default': 'aria2c'}
+        opts['external_downloader_args'] = {'aria2c': [
+            '-x', str(connections), '-s', str(connections), '-k', '1M',
+            '--summary-interval=0', '--console-log-level=warn',
+        ]}
+    return opts
+
+class ConnectionBudget:
+    """Shares a global number of download connections among jobs.
+
+    Every transfer asks for up to per_job connections and gets what is left
+    of its job's share and the global budget, waiting only when none are
+    free at all. Bulk jobs therefore can't open so many connections that
+    everyone else's downloads stall.
+    """
+
+    def __init__(self, total, per_job):
+        self.total = total
+        self.per_job = per_job
+        self.in_use = 0
+        self.by_job = {}
+        self.condition = asyncio.Condition()
+
+    def _grant(self, job_id, want):
+        free = self.total - self.in_use if self.total else want
+        job_free = self.per_job - self.by_job.get(job_id, 0) if self.per_job else want
+        return min(want, free, job_free)
+
+    @asynccontextmanager
+    async def acquire(self, job_id, want=None):
+        """Hold connections for one transfer, yields how many were granted"""
+        want = want or self.per_job or 1
+        async with self.condition:
+            granted = self._grant(job_id, want)
+            while granted < 1:
+                await self.condition.wait()
+                granted = self._grant(job_id, want)
+            self.in_use += granted
+            self.by_job[job_id] = self.by_job.get(job_id, 0) + granted
+
+        try:
+            yield granted
+        finally:
+            async with self.condition:
+                self.in_use -= granted
+                remaining = self.by_job.get(job_id, 0) - granted
+                if remaining > 0:
+                    self.by_job[job_id] = remaining
+                else:
+                    self.by_job.pop(job_id, None)
+                self.condition.notify_all()
+
+connection_budget = ConnectionBudget(
+    Config.PROCESS_DOWNLOAD_CONNECTIONS,
+    Config.DOWNLOAD_CONNECTIONS_PER_JOB
+)
@@ -0,0 +1,95 @@
+import logging
+from config import Config
+from format_utils import get_format_string, select_stream_pair, estimate_entry_size
+
+logger = logging.getLogger(__name__)
+
+# Placeholder titles YouTube lists for videos that can no longer be watched
+DEAD_TITLES = {'[Private video]', '[Deleted video]', '[Unavailable video]'}
+# Flat availability values our accounts can't download
+UNAVAILABLE_AVAILABILITY = {'private', 'premium_only', 'subscriber_only'}
+
+def is_unavailable(entry):
+    """Whether flat playlist metadata already shows the entry can't be downloaded"""
+    return entry.get('title') in DEAD_TITLES or entry.get('availability') in UNAVAILABLE_AVAILABILITY
+
+def prefilter_entries(flat_info, delivered=frozenset()):
+    """Drop repeated, unavailable and already delivered entries from a flat playlist listing.
+
+    Returns the playlist indices of the entries worth resolving, and how many
+    entries were skipped as duplicates, as unavailable and as delivered.
+    """
+    entries = flat_info.get('entries') or []
+    # yt-dlp only lists the indices when part of the playlist was requested
+    indices = flat_info.get('requested_entries') or range(1, len(entries) + 1)
+
+    kept = []
+    seen = set()
+    duplicates = unavailable = skipped_delivered = 0
+    for index, entry in zip(indices, entries):
+        if not entry:
+            unavailable += 1
+            continue
+        video_id = entry.get('id') or entry.get('url')
+        if video_id in seen:
+            duplicates += 1
+            continue
+        seen.add(video_id)
+        if is_unavailable(entry):
+            unavailable += 1
+            continue
+        if entry.get('id') in delivered:
+            skipped_delivered += 1
+            continue
+        kept.append(index)
+
+    if duplicates or unavailable or skipped_delivered:
+        logger.info(
+            f"Skipping {duplicates} duplicate, {unavailable} unavailable "
+            f"and {skipped_delivered} delivered playlist entries"
+        )
+    return kept, duplicates, unavailable, skipped_delivered
+
+class Entry:
+    """A playlist entry reduced to what the download pipeline needs.
+
+    yt-dlp's info dict, with its list of formats, is only consulted once to
+    pick the format for the job's quality. Afterwards just the chosen format
+    ids and the size estimate are kept.
+    """
+
+    __slots__ = ('id', 'url', 'title', 'size', 'format', 'streams')
+
+    def __init__(self, video_id, url, title, size=0, format=None, streams=None):
+        self.id = video_id
+        self.url = url
+        self.title = title
+        # Expected bytes once downloaded, 0 if unknown
+        self.size = size
+        # yt-dlp format selector, None for audio jobs
+        self.format = format
+        # (video format id, audio format id) when both are fetched in parallel
+        self.streams = streams
+
+    @classmethod
+    def from_info(cls, info, quality=None, audio_format=None):
+        """Resolve the format of an extracted entry for a video quality or audio format"""
+        fmt = streams = None
+        if quality:
+            fmt = get_format_string(quality, info)
+            pair = select_stream_pair(quality, info) if Config.PARALLEL_STREAMS else None
+            if pair:
+                streams = (pair[0]['format_id'], pair[1]['format_id'])
+        return cls(
+            info.get('id'),
+            info.get('webpage_url') or info.get('url'),
+            info.get('title'),
+            estimate_entry_size(info, quality, audio_format),
+            fmt,
+            streams,
+        )
+
+    @property
+    def key(self):
+        """Identifies the video across jobs"""
+        return self.id or self.url
@@ -0,0 +1,270 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import yt_dlp
+from yt_dlp.utils import DownloadCancelled
+from yt_dlp.cookies import load_cookies
+from config import Config
+from metrics_utils import extraction_seconds
+
+logger = logging.getLogger(__name__)
+
+# YoutubeDL instances each worker keeps around, keyed by their shared options
+YDL_CACHE_SIZE = 8
+# Options yt-dlp reads on every call, so a warm instance takes them per call
+# instead of needing its own cache entry for each output path or format
+PER_CALL_OPTIONS = {
+    'outtmpl', 'format', 'merge_output_format', 'playlist_items', 'extract_flat',
+    'concurrent_fragment_downloads', 'external_downloader', 'external_downloader_args', 'ratelimit',
+}
+# How often a running download checks for cancellation and rate changes (seconds)
+CANCEL_POLL_INTERVAL = 0.5
+# Worker pools: metadata extraction for probes and job setup, and downloads
+PROBE = 'probe'
+DOWNLOAD = 'download'
+# Worker processes are started from the bot's threads, and forking a threaded
+# process can leave the child holding a lock nobody will release
+PROCESS_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+class ExtractorError(Exception):
+    """A yt-dlp failure from a worker process, carrying only the error message.
+
+    yt-dlp's own exceptions hold tracebacks and can't be sent back over IPC,
+    the message is all is_throttle_error and is_permanent_error look at.
+    """
+
+# State of the current process: the warm instance cache only exists in
+# worker processes, threads in the bot process build a fresh instance per call
+_ydl_cache = None
+_local = threading.local()
+
+def _init_worker():
+    """Warm up a worker: load the extractors once and enable the instance cache"""
+    global _ydl_cache
+    _ydl_cache = OrderedDict()
+    yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}).close()
+
+def _apply_rate_limit(ydl, status=None):
+    """Set the running call's current bandwidth share as yt-dlp's rate limit"""
+    rate_limit = getattr(_local, 'rate_limit', None)
+    rate = rate_limit.get() if rate_limit is not None else 0
+    # Concurrent fragments are each limited separately, so split the share
+    if rate and status and status.get('fragment_count'):
+        rate /= ydl.params.get('concurrent_fragment_downloads') or 1
+    # Downloaders read the live params dict, so a new limit applies mid-file
+    ydl.params['ratelimit'] = rate or None
+
+def _progress_hook(status):
+    """Abort the transfer once cancelled and keep its rate limit at the current share"""
+    now = time.monotonic()
+    if now - getattr(_local, 'last_check', 0) < CANCEL_POLL_INTERVAL:
+        return
+    _local.last_check = now
+
+    cancel_event = getattr(_local, 'cancel_event', None)
+    if cancel_event is not None and cancel_event.is_set():
+        raise DownloadCancelled("Download cancelled by user")
+    ydl = getattr(_local, 'ydl', None)
+    if ydl is not None:
+        _apply_rate_limit(ydl, status)
+
+def _ydl_params(ydl_opts):
+    params = dict(ydl_opts, progress_hooks=[_progress_hook])
+    if Config.YTDLP_CACHE_DIR:
+        params['cachedir'] = Config.YTDLP_CACHE_DIR
+    return params
+
+def _use_cookies(ydl, cookiefile):
+    """Give a warm instance the current contents of cookiefile.
+
+    Cached instances are built without a cookiefile, so closing them never
+    writes an old jar over cookies replaced or deleted since. The jar is
+    reloaded whenever the call uses another file or the file has changed.
+    """
+    try:
+        source = (cookiefile, os.path.getmtime(cookiefile)) if cookiefile else None
+    except OSError:
+        source = None
+    if getattr(ydl, '_cookie_source', None) == source and 'cookiejar' in ydl.__dict__:
+        return
+    ydl.__dict__['cookiejar'] = load_cookies(source[0] if source else None, None, ydl)
+    ydl._cookie_source = source
+    # Request handlers keep the jar they were built with
+    if '_request_director' in ydl.__dict__:
+        ydl._request_director.close()
+        del ydl._request_director
+
+def _run(func, ydl_opts):
+    """Call func with a YoutubeDL for ydl_opts, reusing a warm one in workers"""
+    if _ydl_cache is None:
+        with yt_dlp.YoutubeDL(_ydl_params(ydl_opts)) as ydl:
+            return func(ydl)
+
+    shared = {k: v for k, v in ydl_opts.items() if k not in PER_CALL_OPTIONS and k != 'cookiefile'}
+    key = repr(sorted(shared.items()))
+    ydl = _ydl_cache.get(key)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(_ydl_params(shared))
+        _ydl_cache[key] = ydl
+        if len(_ydl_cache) > YDL_CACHE_SIZE:
+            _, stale = _ydl_cache.popitem(last=False)
+            stale.close()
+    else:
+        _ydl_cache.move_to_end(key)
+
+    for option in PER_CALL_OPTIONS:
+        if option in ydl_opts:
+            ydl.params[option] = ydl_opts[option]
+        else:
+            # Left over from the previous call
+            ydl.params.pop(option, None)
+    ydl._parse_outtmpl()
+    _use_cookies(ydl, ydl_opts.get('cookiefile'))
+    return func(ydl)
+
+def _extract_worker(url, ydl_opts):
+    """Extract info without downloading, returns a picklable info dict"""
+    def extract(ydl):
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info) if info else None
+
+    try:
+        return _run(extract, ydl_opts)
+    except Exception as e:
+        raise ExtractorError(str(e)) from None
+
+def _download_worker(url, ydl_opts, cancel_event=None, rate_limit=None):
+    """Download url, returns the path yt-dlp wrote"""
+    def download(ydl):
+        _local.ydl = ydl
+        _apply_rate_limit(ydl)
+        info = ydl.extract_info(url, download=True)
+        if not info:
+            return None
+        # Use the path yt-dlp actually wrote, merged files get the merge extension
+        requested = info.get('requested_downloads') or []
+        return requested[0]['filepath'] if requested else ydl.prepare_filename(info)
+
+    _local.cancel_event = cancel_event
+    _local.rate_limit = rate_limit
+    _local.last_check = 0
+    try:
+        return _run(download, ydl_opts)
+    except Exception as e:
+        raise ExtractorError(str(e)) from None
+    finally:
+        _local.cancel_event = None
+        _local.rate_limit = None
+        _local.ydl = None
+
+class ExtractorPool:
+    """Long-lived yt-dlp worker processes that extraction is handed to over IPC.
+
+    Signature and player decoding is CPU-bound Python that would otherwise
+    hold the GIL away from the bot's event loop. Workers keep their loaded
+    extractors, recent YoutubeDL instances and the on-disk cache warm across
+    calls. With no workers configured everything runs in the calling thread.
+
+    Metadata extraction has its own small pool, so URL probes never queue
+    behind long downloads. Each pool runs inline when its size is 0.
+
+    Calls block until the worker is done, so run them from a thread.
+    """
+
+    def __init__(self, workers, probe_workers):
+        self.sizes = {PROBE: probe_workers, DOWNLOAD: workers}
+        self._executors = {}
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _pool(self, kind):
+        with self._lock:
+            if kind not in self._executors:
+                self._executors[kind] = ProcessPoolExecutor(
+                    max_workers=self.sizes[kind], mp_context=PROCESS_CONTEXT, initializer=_init_worker
+                )
+                logger.info(f"Started {self.sizes[kind]} {kind} extractor worker processes")
+            return self._executors[kind]
+
+    def _shared(self):
+        # Plain events and values can't be passed to running workers, manager proxies can
+        with self._lock:
+            if self._manager is None:
+                self._manager = PROCESS_CONTEXT.Manager()
+            return self._manager
+
+    def _submit(self, kind, func, *args):
+        try:
+            return self._pool(kind).submit(func, *args)
+        except BrokenProcessPool:
+            self._reset(kind)
+            return self._pool(kind).submit(func, *args)
+
+    def _result(self, kind, future, timeout=None):
+        try:
+            return future.result(timeout)
+        except BrokenProcessPool as e:
+            # A worker died (OOM, segfault), start over with a fresh pool next call
+            self._reset(kind)
+            raise ExtractorError(f"Extractor worker crashed: {str(e)}") from None
+
+    def _reset(self, kind):
+        with self._lock:
+            executor = self._executors.pop(kind, None)
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                logger.warning(f"{kind.capitalize()} extractor worker pool restarted")
+
+    def extract_info(self, url, ydl_opts):
+        """Extract info for url without downloading"""
+        with extraction_seconds.time():
+            if not self.sizes[PROBE]:
+                return _extract_worker(url, ydl_opts)
+            return self._result(PROBE, self._submit(PROBE, _extract_worker, url, ydl_opts))
+
+    def download(self, url, ydl_opts, cancel_event=None, rate_limit=None):
+        """Download url, aborting mid-file once cancel_event is set.
+
+        ``rate_limit`` is the job's bandwidth Transfer, its share is followed
+        for as long as the download runs.
+        """
+        if rate_limit is None:
+            return self._download(url, ydl_opts, cancel_event)
+        with rate_limit.stream():
+            return self._download(url, ydl_opts, cancel_event, rate_limit)
+
+    def _download(self, url, ydl_opts, cancel_event=None, rate_limit=None):
+        if not self.sizes[DOWNLOAD]:
+            return _download_worker(url, ydl_opts, cancel_event, rate_limit)
+
+        manager = self._shared() if cancel_event is not None or rate_limit is not None else None
+        remote_event = manager.Event() if cancel_event is not None else None
+        remote_rate = manager.Value('d', rate_limit.get()) if rate_limit is not None else None
+        future = self._submit(DOWNLOAD, _download_worker, url, ydl_opts, remote_event, remote_rate)
+        while True:
+            try:
+                return self._result(DOWNLOAD, future, timeout=CANCEL_POLL_INTERVAL)
+            except FutureTimeoutError:
+                # Relay the job's cancel event and bandwidth share into the worker process
+                if cancel_event is not None and cancel_event.is_set() and not remote_event.is_set():
+                    remote_event.set()
+                if remote_rate is not None and remote_rate.get() != rate_limit.get():
+                    remote_rate.set(rate_limit.get())
+
+    def shutdown(self):
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._executors.clear()
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+
+extractor = ExtractorPool(Config.EXTRACTOR_WORKERS, Config.PROBE_WORKERS)
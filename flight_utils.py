@@ -0,0 +1,92 @@
+import os
+import shutil
+import asyncio
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Flight:
+    """One shared download and the jobs waiting for its file"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cancel_event = threading.Event()
+        self.waiters = 0
+        self.task = None
+
+class SingleFlight:
+    """Coalesces identical downloads that are in flight at the same time.
+
+    The first job to ask for a key starts the download into a shared
+    directory, later jobs asking for the same key attach to it. When it
+    finishes every job gets its own hard link (or copy) of the file, so the
+    usual per-user delivery and cleanup keep working. The shared download is
+    only cancelled once every job waiting for it has been cancelled.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.flights = {}
+
+    async def run(self, key, destination, download):
+        """Get the file for key into destination, downloading it at most once.
+
+        ``download(directory, cancel_event)`` is awaited to do the actual
+        transfer and returns the downloaded path or None. It should stop on
+        ``cancel_event`` rather than on the cancellation of whichever job
+        started it, since other jobs may still be waiting for the file. Returns the path of
+        this caller's copy, or None if the download failed.
+        """
+        flight = self.flights.get(key)
+        # A flight whose jobs all left is still winding down, start a fresh one
+        if flight is None or flight.cancel_event.is_set():
+            # Every flight gets its own directory, so one winding down can't
+            # delete the files of the next flight for the same key
+            directory = os.path.join(self.root, uuid.uuid4().hex)
+            flight = Flight(directory)
+            flight.task = asyncio.create_task(self._fly(key, flight, download))
+            self.flights[key] = flight
+        else:
+            logger.info(f"Joining in-flight download {key}")
+
+        flight.waiters += 1
+        try:
+            path = await asyncio.shield(flight.task)
+            return await self._deliver(path, destination)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                # Nobody else needs this file anymore
+                flight.cancel_event.set()
+            raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and flight.task.done():
+                shutil.rmtree(flight.directory, ignore_errors=True)
+
+    async def _fly(self, key, flight, download):
+        try:
+            return await download(flight.directory, flight.cancel_event)
+        finally:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            if flight.waiters == 0:
+                # Every job waiting for it was cancelled
+                shutil.rmtree(flight.directory, ignore_errors=True)
+
+    async def _deliver(self, path, destination):
+        if not path or not os.path.exists(path):
+            return None
+        os.makedirs(destination, exist_ok=True)
+        target = os.path.join(destination, os.path.basename(path))
+        if os.path.exists(target):
+            return target
+        try:
+            os.link(path, target)
+        except OSError:
+            # Different filesystem or no hard link support
+            await asyncio.to_thread(shutil.copy2, path, target)
+        return target
+
+flights = SingleFlight(os.path.join("downloads", "shared"))
@@ -0,0 +1,162 @@
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Largest file we send to Telegram in one message (2GB limit, slightly less to be safe)
+TELEGRAM_MAX_FILE_SIZE = 1.9 * 1024 * 1024 * 1024
+
+# Height-capped format selectors for each fixed quality option
+FORMAT_STRINGS = {
+    '144': 'bestvideo[height<=144]+bestaudio/best[height<=144]',
+    '240': 'bestvideo[height<=240]+bestaudio/best[height<=240]',
+    '360': 'bestvideo[height<=360]+bestaudio/best[height<=360]',
+    '480': 'bestvideo[height<=480]+bestaudio/best[height<=480]',
+    '720': 'bestvideo[height<=720]+bestaudio/best[height<=720]',
+    '1080': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
+    '2160': 'bestvideo[height<=2160]+bestaudio/best[height<=2160]'
+}
+
+# Audio containers that merge into the MP4 output with a plain stream copy
+MP4_AUDIO_EXTENSIONS = {'m4a', 'mp4'}
+
+def quality_label(quality):
+    """Human readable name for a quality option"""
+    if quality == 'auto':
+        return f"Auto (≤{Config.AUTO_QUALITY_CAP}p, no splitting)"
+    return f"{quality}p"
+
+def has_video(fmt):
+    return fmt.get('vcodec') not in (None, 'none') and bool(fmt.get('height'))
+
+def has_audio(fmt):
+    return fmt.get('acodec') not in (None, 'none')
+
+def format_filesize(fmt, duration=None):
+    """Size of a single format in bytes, estimated from bitrate if not reported"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        # tbr is in kbit/s
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return size
+
+def _merge_cost(video_fmt, audio_fmt=None):
+    """0 for a single progressive file, 1 for an MP4 stream-copy merge, 2 if a remux is needed"""
+    if audio_fmt is None:
+        return 0
+    if video_fmt.get('ext') == 'mp4' and audio_fmt.get('ext') in MP4_AUDIO_EXTENSIONS:
+        return 1
+    return 2
+
+def select_auto_format(info, max_size=TELEGRAM_MAX_FILE_SIZE, max_height=None):
+    """Pick the highest quality format that fits in a single message.
+
+    Among formats of the same height, progressive files are preferred over
+    merges and MP4-compatible merges over ones needing a remux. Returns a
+    yt-dlp format selector, or None if nothing with a known size fits.
+    """
+    formats = info.get('formats') or []
+    duration = info.get('duration')
+
+    videos = [f for f in formats if has_video(f) and (not max_height or f['height'] <= max_height)]
+    audios = [f for f in formats if has_audio(f) and not has_video(f)]
+
+    best = None
+    for video in videos:
+        video_size = format_filesize(video, duration)
+        if not video_size:
+            continue
+
+        if has_audio(video):
+            pairs = [(None, 0)]
+        else:
+            pairs = [(audio, format_filesize(audio, duration)) for audio in audios]
+
+        for audio, audio_size in pairs:
+            if audio is not None and not audio_size:
+                continue
+            size = video_size + audio_size
+            if size > max_size:
+                continue
+
+            key = (video['height'], -_merge_cost(video, audio), size)
+            if best is None or key > best[0]:
+                selector = video['format_id'] if audio is None else f"{video['format_id']}+{audio['format_id']}"
+                best = (key, selector)
+
+    return best[1] if best else None
+
+def get_format_string(quality, info=None):
+    """Resolve a quality option into a yt-dlp format selector"""
+    if quality == 'auto':
+        selector = select_auto_format(info, max_height=Config.AUTO_QUALITY_CAP) if info else None
+        if selector:
+            return selector
+        # Nothing with a known size fits, so behave like the capped quality
+        logger.info("No single-file format found for auto quality, falling back to the cap")
+        return FORMAT_STRINGS.get(str(Config.AUTO_QUALITY_CAP), 'bestvideo+bestaudio/best')
+    return FORMAT_STRINGS.get(quality, 'bestvideo+bestaudio/best')
+
+def select_stream_pair(quality, info):
+    """The separate video and audio formats a quality resolves to, or None.
+
+    None means the pick is a single progressive file (or can't be told from
+    info), in which case there is nothing to fetch in parallel.
+    """
+    formats = info.get('formats') or []
+    if quality == 'auto':
+        selector = select_auto_format(info, max_height=Config.AUTO_QUALITY_CAP)
+        if not selector or '+' not in selector:
+            return None
+        by_id = {f.get('format_id'): f for f in formats}
+        video_id, audio_id = selector.split('+', 1)
+        return by_id[video_id], by_id[audio_id]
+
+    max_height = int(quality)
+    # yt-dlp sorts formats from worst to best, so the last match is what it picks
+    videos = [f for f in formats if has_video(f) and not has_audio(f) and f['height'] <= max_height]
+    audios = [f for f in formats if has_audio(f) and not has_video(f)]
+    if not videos or not audios:
+        return None
+    return videos[-1], audios[-1]
+
+# Bytes per second of decoded 16-bit stereo 44.1kHz PCM
+PCM_BYTES_PER_SECOND = 44100 * 2 * 2
+
+def estimate_entry_size(info, quality=None, audio_format=None):
+    """Expected size in bytes of one entry once downloaded, 0 if unknown"""
+    formats = info.get('formats') or []
+    duration = info.get('duration') or 0
+
+    if audio_format:
+        if audio_format == 'wav':
+            return duration * PCM_BYTES_PER_SECOND
+        if audio_format == 'flac':
+            # FLAC typically lands a bit above half of the PCM size
+            return duration * PCM_BYTES_PER_SECOND * 0.6
+        if audio_format == 'mp3':
+            return duration * 192000 / 8
+        audios = [f for f in formats if has_audio(f) and not has_video(f)]
+        return (format_filesize(audios[-1], duration) or 0) if audios else 0
+
+    if quality == 'auto':
+        selector = select_auto_format(info, max_height=Config.AUTO_QUALITY_CAP)
+        if selector:
+            by_id = {f.get('format_id'): f for f in formats}
+            return sum(format_filesize(by_id[format_id], duration) or 0 for format_id in selector.split('+'))
+        max_height = Config.AUTO_QUALITY_CAP
+    else:
+        max_height = int(quality)
+
+    # yt-dlp sorts formats from worst to best, so the last match is what it picks
+    videos = [f for f in formats if has_video(f) and not has_audio(f) and f['height'] <= max_height]
+    audios = [f for f in formats if has_audio(f) and not has_video(f)]
+    if videos and audios:
+        return (format_filesize(videos[-1], duration) or 0) + (format_filesize(audios[-1], duration) or 0)
+
+    progressive = [f for f in formats if has_video(f) and has_audio(f) and f['height'] <= max_height]
+    return (format_filesize(progressive[-1], duration) or 0) if progressive else 0
+
+def estimate_total_size(entries, quality=None, audio_format=None):
+    """Expected combined size in bytes of all entries once downloaded"""
+    return int(sum(estimate_entry_size(entry, quality, audio_format) for entry in entries if entry))
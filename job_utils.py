@@ -0,0 +1,285 @@
+import os
+import shutil
+import asyncio
+import logging
+import threading
+from config import Config
+from state_utils import state
+from storage_utils import storage
+
+logger = logging.getLogger(__name__)
+
+class UploadCancelled(Exception):
+    """Raised from inside an upload stream to abort it when the user cancels"""
+
+class JobRegistry:
+    """Runs long jobs as supervised background tasks.
+
+    Handlers hand their work to start() and return straight away, so
+    Pyrogram's handler workers stay free for commands and cancel buttons.
+    Each job is bounded by max_runtime, and unexpected exceptions are passed
+    to the job's on_error callback instead of vanishing with the task.
+
+    Every job also gets a thread-safe cancel event, so work running outside
+    the event loop (yt-dlp hooks, upload streams) can stop mid-transfer.
+    Each run is recorded in the state store with how it ended.
+    """
+
+    def __init__(self, max_runtime=0):
+        self.max_runtime = max_runtime
+        self.tasks = {}
+        self.cancel_events = {}
+
+    def is_running(self, user_id):
+        task = self.tasks.get(user_id)
+        return task is not None and not task.done()
+
+    def start(self, user_id, coro, name, on_error=None):
+        """Run coro in the background as the user's current job"""
+        self.cancel_events[user_id] = threading.Event()
+        task = asyncio.create_task(self._supervise(user_id, coro, name, on_error), name=f"{name}-{user_id}")
+        self.tasks[user_id] = task
+        return task
+
+    async def _supervise(self, user_id, coro, name, on_error):
+        record_id = state.job_started(user_id, name)
+        status, error = "done", None
+        try:
+            if self.max_runtime:
+                await asyncio.wait_for(coro, self.max_runtime)
+            else:
+                await coro
+        except asyncio.CancelledError:
+            status = "cancelled"
+            logger.info(f"Job {name} for user {user_id} was cancelled")
+            raise
+        except asyncio.TimeoutError as e:
+            status = "timeout"
+            logger.error(f"Job {name} for user {user_id} exceeded {self.max_runtime}s and was stopped")
+            await self._report(on_error, e)
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.exception(f"Job {name} for user {user_id} failed: {str(e)}")
+            await self._report(on_error, e)
+        finally:
+            state.job_finished(record_id, status, error)
+            if self.tasks.get(user_id) is asyncio.current_task():
+                self.tasks.pop(user_id, None)
+
+    async def _report(self, on_error, error):
+        if not on_error:
+            return
+        try:
+            await on_error(error)
+        except Exception as e:
+            logger.error(f"Failed to report job error: {str(e)}")
+
+    def cancel_event(self, user_id):
+        """Event that is set once the user's current job is cancelled"""
+        return self.cancel_events.setdefault(user_id, threading.Event())
+
+    def is_cancelled(self, user_id):
+        return self.cancel_event(user_id).is_set()
+
+    def cancel(self, user_id):
+        """Signal and cancel the user's running job, returns its task or None"""
+        self.cancel_event(user_id).set()
+        task = self.tasks.get(user_id)
+        if task is None or task.done():
+            return None
+        task.cancel()
+        return task
+
+    async def shutdown(self):
+        """Cancel every running job and wait for them to unwind"""
+        tasks = [task for task in self.tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+class Job:
+    """A user's current job: what was asked for, where it stands and its files.
+
+    The fields a later step needs (the URL, the chosen format, the downloaded
+    files) are saved to the state store, so the upload buttons keep working
+    after a restart. The entries being downloaded and the upload message
+    bookkeeping only live in memory and are dropped when the job finishes.
+    """
+
+    __slots__ = (
+        'user_id', 'url', 'items', 'sync_id', 'title', 'quality', 'audio_format',
+        'files', 'entry_ids', 'zip_mode', 'estimates',
+        'entries', 'status_message_id', 'cancelled', 'cancelled_uploads', 'progress_updated_at',
+    )
+    # Fields saved to the state store
+    PERSISTED = ('url', 'items', 'sync_id', 'title', 'quality', 'audio_format', 'files', 'entry_ids', 'zip_mode', 'estimates')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        for field in self.PERSISTED:
+            setattr(self, field, None)
+        self.zip_mode = False
+        self.entries = None
+        self.status_message_id = None
+        self.cancelled = False
+        self.cancelled_uploads = set()
+        self.progress_updated_at = 0
+
+    def load(self, data):
+        for field in self.PERSISTED:
+            if field in data:
+                setattr(self, field, data[field])
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.PERSISTED}
+
+    def save(self):
+        state.set(self.user_id, self.to_dict())
+
+    async def reset(self, **fields):
+        """Start over on a new request, keeping the running status.
+
+        Files a previous request left behind are deleted, nothing can upload
+        them once the job points at the new request.
+        """
+        if self.files:
+            await self.discard()
+        for field in self.PERSISTED:
+            setattr(self, field, fields.get(field))
+        self.zip_mode = False
+        self.entries = None
+        self.save()
+
+    @property
+    def directory(self):
+        return f"downloads/{self.user_id}"
+
+    @property
+    def is_audio(self):
+        return self.audio_format is not None
+
+    @property
+    def active(self):
+        """Whether the job has a status message, i.e. a step is in progress"""
+        return self.status_message_id is not None
+
+    @property
+    def busy(self):
+        return self.active and not self.cancelled
+
+    @property
+    def estimated_size(self):
+        """Download size the probe estimated for the chosen option, 0 if unknown"""
+        return (self.estimates or {}).get(self.audio_format or self.quality) or 0
+
+    @property
+    def download_size(self):
+        """Expected bytes the entries download to"""
+        return int(sum(entry.size for entry in self.entries or []))
+
+    @property
+    def footprint(self):
+        """Disk space the job needs: all outputs plus room for the largest in-progress merge"""
+        sizes = [entry.size for entry in self.entries or []]
+        return int(sum(sizes) + max(sizes)) if sizes else 0
+
+    def start(self, status_message_id):
+        self.status_message_id = status_message_id
+        self.cancelled = False
+
+    def finish(self):
+        """Mark the current step done and drop what only it needed"""
+        self.status_message_id = None
+        self.cancelled = False
+        self.entries = None
+        self.cancelled_uploads.clear()
+        self.progress_updated_at = 0
+
+    async def discard(self):
+        """Delete the job's files and return their disk space"""
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+        await storage.release(self.user_id)
+
+    async def cleanup(self):
+        """Finish and delete the job's files, returning their disk space"""
+        self.finish()
+        await self.discard()
+        if self.files:
+            self.files = None
+            self.save()
+
+    def upload_cancelled(self, message_id):
+        return message_id in self.cancelled_uploads
+
+class JobTable:
+    """Every user's Job, read through from the state store.
+
+    When worker processes share the store, the saved fields are reloaded on
+    every lookup since another process may have changed them.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def get(self, user_id):
+        """The user's job, or None if they have none or its session expired"""
+        job = self.jobs.get(user_id)
+        if job is not None and not state.shared:
+            return job
+        data = state.get(user_id)
+        if data is None:
+            return job
+        if job is None:
+            job = self.jobs[user_id] = Job(user_id)
+        job.load(data)
+        return job
+
+    def current(self, user_id):
+        """The user's job, creating an empty one if needed"""
+        job = self.get(user_id)
+        if job is None:
+            job = self.jobs[user_id] = Job(user_id)
+        return job
+
+    def is_busy(self, user_id):
+        job = self.jobs.get(user_id)
+        return job is not None and job.busy
+
+    def is_cancelled(self, user_id):
+        job = self.jobs.get(user_id)
+        return job is not None and job.cancelled
+
+    async def purge(self):
+        """Forget jobs whose session has expired, unless they are still running.
+
+        Files a job downloaded here and nobody uploaded or cancelled are
+        deleted with it, and their disk space returned to the budget.
+        """
+        for user_id, job in list(self.jobs.items()):
+            if jobs.is_running(user_id) or state.get(user_id) is not None:
+                continue
+            # The reservation marks the process that holds the job's files
+            if user_id in storage.reserved:
+                await job.discard()
+            del self.jobs[user_id]
+
+async def run_in_thread(func, *args):
+    """Run blocking func in a thread without abandoning it on cancellation.
+
+    If the awaiting job is cancelled, wait for the thread to notice its
+    cancel event and stop before re-raising, so the job's files are not
+    removed while the thread is still writing them.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        try:
+            await future
+        except Exception:
+            pass
+        raise
+
+jobs = JobRegistry(max_runtime=Config.JOB_TIMEOUT_HOURS * 3600)
+user_jobs = JobTable()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from collections import deque
+from pyrogram.errors import FloodWait
+from config import Config
+from metrics_utils import record_flood_wait
+
+logger = logging.getLogger(__name__)
+
+LOG_TAG = "#PlaylistBotLogs"
+# Telegram's message length limit
+MAX_MESSAGE_LENGTH = 4096
+EVENT_SEPARATOR = "\n\n➖➖➖\n\n"
+# Once the queue is half full only one in this many routine events is kept
+PRESSURE_SAMPLE_RATE = 5
+
+class LogPipeline:
+    """Delivers log channel events in periodic digests without blocking callers.
+
+    Events go into a bounded queue and are sent every interval seconds,
+    several per message. Under pressure routine events are sampled, and
+    when the queue is full they make room for important ones (failures,
+    unauthorized access) or are dropped. Dropped events are counted in the
+    next digest.
+    """
+
+    def __init__(self, capacity, interval):
+        self.capacity = capacity
+        self.interval = interval
+        self.events = deque()
+        self.dropped = 0
+        self._routine_seen = 0
+
+    def emit(self, text, important=False):
+        """Queue an event for the next digest, never waits"""
+        if not important and len(self.events) >= self.capacity // 2:
+            self._routine_seen += 1
+            if self._routine_seen % PRESSURE_SAMPLE_RATE:
+                self.dropped += 1
+                return
+
+        if len(self.events) >= self.capacity:
+            routine = next((event for event in self.events if not event[1]), None)
+            if not important:
+                self.dropped += 1
+                return
+            self.events.remove(routine if routine is not None else self.events[0])
+            self.dropped += 1
+        self.events.append((text, important))
+
+    def _digests(self, events):
+        """Pack events into as few messages as fit Telegram's length limit"""
+        bodies = [text.replace(LOG_TAG, "", 1).strip() for text, _ in events]
+        if self.dropped:
+            bodies.append(f"⚠️ {self.dropped} routine events were dropped while the log was busy")
+            self.dropped = 0
+
+        messages = []
+        current = LOG_TAG
+        for body in bodies:
+            body = body[:MAX_MESSAGE_LENGTH - len(LOG_TAG) - len(EVENT_SEPARATOR)]
+            candidate = f"{current}\n{body}" if current == LOG_TAG else f"{current}{EVENT_SEPARATOR}{body}"
+            if len(candidate) > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                candidate = f"{LOG_TAG}\n{body}"
+            current = candidate
+        if current != LOG_TAG:
+            messages.append(current)
+        return messages
+
+    async def flush(self, send):
+        """Send everything queued so far"""
+        if not self.events and not self.dropped:
+            return
+        events = list(self.events)
+        self.events.clear()
+        # Digests of routine events only arrive silently
+        silent = not any(important for _, important in events)
+        for text in self._digests(events):
+            while True:
+                try:
+                    await send(text, silent)
+                    break
+                except FloodWait as e:
+                    logger.warning(f"Log channel rate limited, waiting {e.value}s")
+                    record_flood_wait(e.value)
+                    await asyncio.sleep(e.value)
+                except Exception as e:
+                    logger.error(f"Failed to send log digest: {str(e)}")
+                    break
+
+    async def run(self, send):
+        """Send a digest every interval until cancelled, then the remaining events"""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush(send)
+        finally:
+            await self.flush(send)
+
+log_pipeline = LogPipeline(Config.LOG_QUEUE_SIZE, Config.LOG_DIGEST_INTERVAL)
+
+def send_log(message, important=False):
+    """Queue a message for the log channel, it goes out with the next digest.
+
+    Never waits. Important messages (failures, unauthorized access) are kept
+    over routine ones when the log is busy and make the digest notify.
+    """
+    if Config.LOG_CHANNEL != 0:
+        log_pipeline.emit(message, important)
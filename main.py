@@ -1,13 +1,38 @@
-import yt_dlp
 import os
-import shutil
+import re
+import sys
 import time
+import random
 import subprocess
+import pyrogram
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, LinkPreviewOptions
 import logging
 import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from zip_utils import create_zip_file, upload_zip_to_telegram, upload_zip_to_gofile
+from audio_utils import transcode_audio
+from format_utils import TELEGRAM_MAX_FILE_SIZE, quality_label, estimate_total_size
+from storage_utils import storage
+from throughput_utils import download_meter, upload_meter
+from job_utils import jobs, user_jobs, run_in_thread, UploadCancelled
+from throttle_utils import breaker, is_throttle_error, is_permanent_error, PermanentError
+from cookie_utils import cookie_pool, DEFAULT_COOKIE_FILE
+from proxy_utils import proxy_pool
+from extractor_utils import extractor
+from engine_utils import connection_budget, engine_opts
+from bandwidth_utils import bandwidth, INGRESS, EGRESS
+from scheduler_utils import scheduler, job_lane
+from flight_utils import flights
+from sync_utils import sync_archive, subscriptions
+from entry_utils import prefilter_entries, Entry
+from state_utils import state
+from queue_utils import job_queue
+from log_utils import log_pipeline, send_log
+from profile_utils import profiles
+from metrics_utils import metrics, stage_seconds, gofile_errors, record_flood_wait
 import requests
 from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 from config import Config
@@ -26,41 +51,67 @@ api_id = Config.API_ID
 api_hash = Config.API_HASH
 bot_token = Config.BOT_TOKEN
 
-app = Client("playlist_dl_bot", api_id=api_id, api_hash=api_hash, bot_token=bot_token)
+# Workers log in with their own session and only act on queued jobs
+if Config.WORKER_ID:
+    app = Client(f"playlist_dl_worker_{Config.WORKER_ID}", api_id=api_id, api_hash=api_hash, bot_token=bot_token, no_updates=True)
+else:
+    app = Client("playlist_dl_bot", api_id=api_id, api_hash=api_hash, bot_token=bot_token)
 
-# Store user selections
-user_data = {}
-# Track progress updates
-last_progress_update = {}
-# Track cancelled uploads
-upload_cancelled = {}
-active_processes = {}
-authorized_users = set()
 # Owner ID from config
 OWNER_ID = Config.OWNER_ID
 
-# Load authorized users from file
-def load_authorized_users():
-    auth_file = "authorized_users.txt"
-    if os.path.exists(auth_file):
-        with open(auth_file, "r") as f:
-            for line in f:
-                user_id = line.strip()
-                if user_id.isdigit():
-                    authorized_users.add(int(user_id))
-    logger.info(f"Loaded {len(authorized_users)} authorized users")
-
-# Save authorized users to file
-def save_authorized_users():
-    auth_file = "authorized_users.txt"
-    with open(auth_file, "w") as f:
-        for user_id in authorized_users:
-            f.write(f"{user_id}\n")
-    logger.info(f"Saved {len(authorized_users)} authorized users")
+# How often scheduled playlist syncs are checked (seconds)
+SYNC_CHECK_INTERVAL = 60
+# Links in a message or an uploaded text file
+URL_PATTERN = re.compile(r'https?://\S+')
+# Largest link file read into memory (bytes)
+MAX_URL_FILE_SIZE = 1024 * 1024
+# How often expired sessions and old job records are purged (seconds)
+STATE_PURGE_INTERVAL = 600
+
+# Read from the job structures whenever the metrics endpoint is scraped
+metrics.gauge("playlistdl_active_jobs", "Jobs running in this process",
+              lambda: sum(1 for task in list(jobs.tasks.values()) if not task.done()))
+metrics.gauge("playlistdl_download_slots_used", "Download jobs holding a scheduler slot",
+              lambda: len(scheduler.running))
+metrics.gauge("playlistdl_download_jobs_waiting", "Download jobs waiting for a scheduler slot",
+              lambda: len(scheduler.waiting))
+metrics.gauge("playlistdl_scratch_reserved_bytes", "Scratch space reserved by running jobs",
+              lambda: storage.total_reserved)
+if job_queue:
+    metrics.gauge("playlistdl_queued_jobs", "Jobs in the job queue waiting for a worker", job_queue.depth)
 
 # Check if user is authorized
 def is_authorized(user_id):
-    return user_id == OWNER_ID or user_id in authorized_users
+    return user_id == OWNER_ID or state.is_authorized(user_id)
+
+def job_running(user_id):
+    """Whether a job of the user is running here or waiting for or running on a worker"""
+    if job_queue:
+        return job_queue.has_pending(user_id)
+    return jobs.is_running(user_id)
+
+def has_active_process(user_id):
+    """Whether the user is in the middle of a request and can't start another"""
+    if job_queue:
+        # The status of a job lives on the worker running it, only its files
+        # waiting for an upload choice are shared through the state store
+        job = user_jobs.get(user_id)
+        return job_queue.has_pending(user_id) or bool(job and job.files)
+    return jobs.is_running(user_id) or user_jobs.is_busy(user_id)
+
+def is_cancelled(user_id):
+    """Check whether the user cancelled their current process"""
+    return jobs.is_cancelled(user_id) or user_jobs.is_cancelled(user_id)
+
+async def wait_for_process(process):
+    """Wait for a subprocess, killing it if the job is cancelled meanwhile"""
+    try:
+        return await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
 
 def format_size(size_bytes):
     """Format size in bytes to human readable format"""
@@ -89,12 +140,152 @@ def create_download_folder(user_id):
         os.makedirs(download_path)
     return download_path
 
+async def admit_job(job, message):
+    """Schedule a job and reserve its disk space before it starts downloading.
+
+    Jobs that can never fit are rejected. The rest wait until their disk
+    space is free, and then for a download slot, cheapest jobs and priority
+    lanes first. Waiting for disk doesn't hold a slot, so a full disk only
+    stalls the jobs that need it. Returns False if the job was rejected.
+    """
+    user_id = job.user_id
+    job_size = job.footprint
+    bandwidth.set_job_size(user_id, job_size)
+    reason = storage.check(user_id, job_size)
+    if reason:
+        await message.edit_text(
+            f"❌ This download needs about {format_size(job_size)} of disk space, which {reason}.\n"
+            f"Please pick a lower quality or a shorter playlist."
+        )
+        return False
+
+    if not await storage.reserve(user_id, job_size, wait=False):
+        await message.edit_text(
+            f"⏳ Waiting for {format_size(job_size)} of disk space to free up...\n"
+            f"Your download will start automatically."
+        )
+        await storage.reserve(user_id, job_size)
+
+    # Cost is the expected download volume, the entry count stands in when sizes are unknown
+    cost = max(job.download_size, len(job.entries))
+    if not scheduler.has_free_slot():
+        await message.edit_text(
+            "⏳ All download slots are busy, your job is queued.\n"
+            "Smaller downloads go first, your download will start automatically."
+        )
+    await scheduler.acquire(user_id, cost, job_lane(user_id))
+    return True
+
+async def release_delivered_file(user_id, file_path):
+    """Delete a file that has been delivered and return its space to the budget"""
+    try:
+        file_size = os.path.getsize(file_path)
+        os.remove(file_path)
+    except OSError as e:
+        logger.error(f"Error removing delivered file {file_path}: {str(e)}")
+        return
+    await storage.release(user_id, file_size)
+
+def pending_entries(job, playlist_info):
+    """Entries a job should download, in sync mode only the ones not delivered before"""
+    if not job.sync_id:
+        return playlist_info['entries']
+    return sync_archive.new_entries(job.user_id, job.sync_id, playlist_info['entries'])
+
+def sync_delivery(job):
+    """What an upload adds to the sync archive: the sync_id and each file's video id"""
+    # Sync runs record what was delivered so the next run skips it
+    if not job.sync_id:
+        return None
+    return job.sync_id, dict(zip(job.files, job.entry_ids or []))
+
+def job_error_reporter(user_id, status_message):
+    """Build the on_error callback that cleans up and reports a crashed job"""
+    async def report(error):
+        await user_jobs.current(user_id).cleanup()
+
+        reason = str(error) or type(error).__name__
+        try:
+            await status_message.edit_text(f"❌ Something went wrong: {reason}\nPlease try again.")
+        except Exception as e:
+            logger.error(f"Failed to report job error to user: {str(e)}")
+        send_log(
+            "#PlaylistBotLogs \n"
+            f"❌ Job failed!\n"
+            f"🆔 ID: `{user_id}`\n"
+            f"⚠️ Error: {reason}",
+            important=True
+        )
+    return report
+
+async def run_download_job(user_id, message, download, upload=None):
+    """Background job: run a playlist download and clean up if it fails or is rejected.
+
+    ``upload`` is the (upload_type, zip_mode) of a scheduled sync, whose
+    files are uploaded straight away instead of waiting for a choice.
+    """
+    try:
+        result = await download
+    finally:
+        await scheduler.release(user_id)
+    
+    # If download failed, was rejected (None, already reported) or was cancelled
+    if not result:
+        if result is not None and not is_cancelled(user_id):
+            await message.edit_text("Download failed. Please try again.")
+        await user_jobs.current(user_id).cleanup()
+        return
+    
+    if upload:
+        upload_type, zip_mode = upload
+        job = user_jobs.current(user_id)
+        job.zip_mode = zip_mode
+        job.save()
+        dispatch(user_id, 'upload', message, pinned=True, upload_type=upload_type, delivered=sync_delivery(job))
+
+def build_job(kind, user_id, message, payload):
+    """The coroutine and name of a job, built the same way here and on workers"""
+    if kind == 'probe':
+        sync = payload.get('sync', False)
+        coro = probe_playlist(user_id, payload['mention'], payload['url'], message, sync=sync, items=payload.get('items'),
+                              schedule=payload.get('schedule'))
+        return coro, "playlist sync" if sync else "playlist probe"
+    job = user_jobs.current(user_id)
+    if kind == 'download':
+        upload = payload.get('upload')
+        if job.is_audio:
+            return run_download_job(user_id, message, download_playlist_audio(job, message), upload), "audio download"
+        return run_download_job(user_id, message, download_playlist(job, message), upload), "video download"
+    if kind == 'upload':
+        upload_type = payload['upload_type']
+        coro = run_upload_job(user_id, upload_type, job.files, job.title, job.zip_mode, message, payload.get('delivered'))
+        return coro, f"{upload_type} upload"
+    if kind == 'cleanup':
+        return finish_cancel(user_id, jobs.cancel(user_id), message), "cancel cleanup"
+    raise ValueError(f"Unknown job kind: {kind}")
+
+def dispatch(user_id, kind, message, pinned=False, **payload):
+    """Start a job in the background, or queue it for a worker if a job queue is set up.
+
+    ``message`` is the job's status message. Pinned jobs need the files of
+    the user's previous job and run on the worker that has them.
+    """
+    if job_queue:
+        # Downloads and uploads are ordered by the probe's size estimate, probes and cleanups are cheap
+        cost = user_jobs.current(user_id).estimated_size if kind in ('download', 'upload') else 0
+        job_queue.put(
+            user_id, kind, {'chat_id': message.chat.id, 'message_id': message.id, **payload},
+            pinned=pinned, lane=job_lane(user_id), cost=cost
+        )
+        return
+    coro, name = build_job(kind, user_id, message, payload)
+    jobs.start(user_id, coro, name, on_error=job_error_reporter(user_id, message))
+
 # Add this function to check file size
 def check_file_size(file_path):
     """Check if file size exceeds Telegram's limit"""
     file_size = os.path.getsize(file_path)
-    # 2GB limit for regular users (slightly less to be safe)
-    return file_size > 1.9 * 1024 * 1024 * 1024
+    return file_size > TELEGRAM_MAX_FILE_SIZE
 
 # Add this function to split large videos
 async def split_video(file_path, user_id, message):
@@ -166,7 +357,7 @@ async def split_video(file_path, user_id, message):
                     stderr=asyncio.subprocess.PIPE
                 )
                 
-                code = await process.wait()
+                code = await wait_for_process(process)
                 
                 if code != 0:
                     err = (await process.stderr.read()).decode().strip()
@@ -187,7 +378,7 @@ async def split_video(file_path, user_id, message):
                         stderr=asyncio.subprocess.PIPE
                     )
                     
-                    code = await process.wait()
+                    code = await wait_for_process(process)
                     
                     if code != 0:
                         err = (await process.stderr.read()).decode().strip()
@@ -224,7 +415,7 @@ async def split_video(file_path, user_id, message):
                 stderr=asyncio.subprocess.PIPE
             )
             
-            code = await process.wait()
+            code = await wait_for_process(process)
             
             if code != 0:
                 err = (await process.stderr.read()).decode().strip()
@@ -250,11 +441,23 @@ async def split_video(file_path, user_id, message):
 
 async def progress(current, total, message, start_time, operation, filename=None, playlist_title=None, file_index=None, total_files=None):
     """Generic progress callback for uploads/downloads"""
+    job = user_jobs.get(message.chat.id)
+    # Stop the transfer right away once the user cancels, not at the next redraw
+    if is_cancelled(message.chat.id) or (job and job.upload_cancelled(message.id)):
+        app.stop_transmission()
+
+    # Holding the callback back paces the upload to this job's bandwidth share
+    transfer = bandwidth.get(EGRESS, message.chat.id)
+    if transfer:
+        pause = transfer.delay(current)
+        if pause:
+            await asyncio.sleep(pause)
+
     try:
         now = time.time()
         elapsed_time = now - start_time
         
-        last_update = last_progress_update.get(message.id, 0)
+        last_update = job.progress_updated_at if job else 0
         
         # Update only every 5 seconds or when complete
         if current == total or (now - last_update) >= 5:
@@ -295,12 +498,9 @@ async def progress(current, total, message, start_time, operation, filename=None
                     # Store the new text
                     message._last_progress_text = progress_text
                 
-                # Update last progress time for this message
-                last_progress_update[message.id] = now
-                
-                # Check if upload was cancelled
-                if upload_cancelled.get(message.id, False):
-                    raise asyncio.CancelledError("Upload cancelled by user")
+                # Update last progress time for this job
+                if job:
+                    job.progress_updated_at = now
             except asyncio.CancelledError:
                 raise
             except pyrogram.errors.exceptions.bad_request_400.MessageNotModified:
@@ -314,142 +514,399 @@ async def progress(current, total, message, start_time, operation, filename=None
     except Exception as e:
         print(f"Progress callback error: {str(e)}")
 
-def get_video_info(url):
-    """Get playlist information"""
+def get_video_info(url, network_opts=None, playlist_items=None, delivered=None):
+    """Get playlist information, only resolving the entries in playlist_items if given.
+
+    The playlist is listed flat first, so repeated and unavailable entries
+    are dropped before any of them is resolved. So are the entries of a sync
+    already delivered, ``delivered`` maps the flat listing to their ids.
+    The counts are returned in the info as 'skipped_duplicates',
+    'skipped_unavailable' and 'skipped_delivered'.
+    """
+    cookiefile = cookie_pool.acquire()
     ydl_opts = {
         'quiet': True,
-        'cookiefile': 'cookies.txt',
+        'cookiefile': cookiefile,
         'no_warnings': True,
         'format': 'best',
         'outtmpl': '%(title)s.%(ext)s',
+        **(network_opts or {}),
     }
+    if playlist_items:
+        ydl_opts['playlist_items'] = playlist_items
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            result = ydl.extract_info(url, download=False)
-            return result
-        except Exception as e:
-            logger.error(f"Error getting playlist info: {str(e)}")
-            return None
+    try:
+        flat_info = extractor.extract_info(url, {**ydl_opts, 'extract_flat': 'in_playlist'})
+        # Single videos come back fully extracted already
+        if not flat_info or flat_info.get('_type') != 'playlist':
+            return flat_info
+        
+        indices, duplicates, unavailable, skipped_delivered = prefilter_entries(
+            flat_info, delivered(flat_info) if delivered else frozenset()
+        )
+        if indices:
+            info = extractor.extract_info(url, {**ydl_opts, 'playlist_items': ",".join(map(str, indices))})
+        else:
+            info = {**flat_info, 'entries': []}
+        if info:
+            info['skipped_duplicates'] = duplicates
+            info['skipped_unavailable'] = unavailable
+            info['skipped_delivered'] = skipped_delivered
+        breaker.record_success()
+        return info
+    except Exception as e:
+        logger.error(f"Error getting playlist info: {str(e)}")
+        if is_throttle_error(e):
+            breaker.record_throttle()
+            cookie_pool.report_throttle(cookiefile)
+        return None
 
-def download_video(video_url, download_path, quality):
-    """Download a single video with specified quality"""
-    format_string = {
-        '144': 'bestvideo[height<=144]+bestaudio/best[height<=144]',
-        '240': 'bestvideo[height<=240]+bestaudio/best[height<=240]',
-        '360': 'bestvideo[height<=360]+bestaudio/best[height<=360]',
-        '480': 'bestvideo[height<=480]+bestaudio/best[height<=480]',
-        '720': 'bestvideo[height<=720]+bestaudio/best[height<=720]',
-        '1080': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
-        '2160': 'bestvideo[height<=2160]+bestaudio/best[height<=2160]'
-    }
+async def fetch_video_info(url, playlist_items=None, delivered=None):
+    """Get playlist information off the event loop through the proxy pool"""
+    # Extraction is throttled just like downloads, so it waits out the breaker too
+    await breaker.wait()
+    async with proxy_pool.acquire() as endpoint:
+        return await asyncio.to_thread(get_video_info, url, endpoint.ydl_opts() if endpoint else None, playlist_items, delivered)
+
+def delivered_filter(user_id, sync_id=None, url=None):
+    """Map a flat listing to the ids its sync already delivered to the user.
+
+    Without a sync_id it is taken from the listing, the way a sync probe
+    names the playlist.
+    """
+    return lambda flat_info: sync_archive.load(user_id, sync_id or flat_info.get('id') or url)
+
+async def fetch_playlist(urls, playlist_items=None, delivered=None):
+    """Get one URL's playlist, or the entries of several URLs merged into one.
+
+    Entries repeated across the URLs are kept once. Returns None if none of
+    the URLs could be fetched.
+    """
+    if isinstance(urls, str):
+        return await fetch_video_info(urls, playlist_items, delivered)
     
-    # Debug log to verify the quality parameter
-    logger.info(f"Downloading video with quality: {quality}")
+    results = await asyncio.gather(*(fetch_video_info(url, playlist_items, delivered) for url in urls))
+    infos = [info for info in results if info]
+    if not infos:
+        return None
+    if len(urls) == 1:
+        return infos[0]
     
+    entries = []
+    seen = set()
+    duplicates = sum(info.get('skipped_duplicates', 0) for info in infos)
+    for info in infos:
+        # A single video link is its own entry
+        for entry in info['entries'] if 'entries' in info else [info]:
+            key = entry and (entry.get('id') or entry.get('webpage_url'))
+            if not key:
+                continue
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            entries.append(entry)
+    
+    return {
+        'id': None,
+        'title': f"{infos[0].get('title', 'Playlist')} + {len(infos) - 1} more",
+        'entries': entries,
+        'skipped_duplicates': duplicates,
+        'skipped_unavailable': sum(info.get('skipped_unavailable', 0) for info in infos),
+        'skipped_delivered': sum(info.get('skipped_delivered', 0) for info in infos),
+    }
+
+def parse_playlist_items(text):
+    """Turn a range like '10-40', '10-', 'first 10' or 'last 20' into yt-dlp playlist_items.
+
+    Returns None if text isn't a range.
+    """
+    text = text.strip().lower()
+    match = re.fullmatch(r'(\d+)\s*-\s*(\d*)', text)
+    if match:
+        start, end = match.groups()
+        return f"{start}:{end}"
+    match = re.fullmatch(r'(first|last)\s+(\d+)', text)
+    if match:
+        side, count = match.groups()
+        return f"1:{count}" if side == 'first' else f"-{count}:"
+    return None
+
+def download_video(video_url, download_path, entry, cancel_event=None, cookiefile=None, network_opts=None, connections=1, rate_limit=None):
+    """Download a single video in the format already picked for the entry.
+
+    Separate video and audio streams are fetched side by side and merged
+    afterwards. Setting ``cancel_event`` aborts the transfer mid-file. Errors
+    are raised so download_entry can decide whether to retry.
+    """
+    logger.info(f"Downloading video with format: {entry.format}")
+    
+    base_opts = {
+        'cookiefile': cookiefile,
+        'no_warnings': True,
+        'quiet': True,
+        **(network_opts or {}),
+    }
+
+    if entry.streams:
+        return download_streams(video_url, download_path, entry.streams, base_opts, cancel_event, connections, rate_limit)
+
     ydl_opts = {
-        'format': format_string.get(quality, 'bestvideo+bestaudio/best'),
+        **base_opts,
+        **engine_opts(connections),
+        'format': entry.format,
         'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
-        'cookiefile': 'cookies.txt',
         'merge_output_format': 'mp4',
-        'ignoreerrors': True,
-        'no_warnings': True,
-        'quiet': True,
     }
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    return extractor.download(video_url, ydl_opts, cancel_event, rate_limit)
+
+def download_streams(video_url, download_path, streams, base_opts, cancel_event=None, connections=1, rate_limit=None):
+    """Fetch a video and its audio stream (by format id) in parallel, then merge them into an MP4"""
+    video_format_id = streams[0]
+    stream_cancel = threading.Event()
+    stream_opts = [
+        {
+            **base_opts,
+            **engine_opts(connections // 2),
+            'format': format_id,
+            'outtmpl': os.path.join(download_path, '%(title)s.f%(format_id)s.%(ext)s'),
+        }
+        for format_id in streams
+    ]
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(extractor.download, video_url, opts, stream_cancel, rate_limit) for opts in stream_opts]
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+            # One failed stream or a cancelled job stops the other one too
+            if (cancel_event is not None and cancel_event.is_set()) or any(f.exception() for f in done):
+                stream_cancel.set()
+    # Raises the first stream's error, finished streams stay on disk for the retry
+    video_path, audio_path = [f.result() for f in futures]
+
+    root = os.path.splitext(video_path)[0]
+    suffix = f".f{video_format_id}"
+    if root.endswith(suffix):
+        root = root[:-len(suffix)]
+    output_path = root + '.mp4'
+
+    result = subprocess.run(
+        [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', video_path, '-i', audio_path,
+            '-map', '0:v:0', '-map', '1:a:0',
+            '-c', 'copy', '-movflags', '+faststart',
+            output_path
+        ],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Merging video and audio failed: {result.stderr.strip()}")
+
+    os.remove(video_path)
+    os.remove(audio_path)
+    return output_path
+
+async def download_entry(user_id, message, download_func, *args, cancel_event=None):
+    """Download one entry, retrying transient failures with exponential backoff.
+
+    Throttling errors feed the global circuit breaker, which pauses every
+    job's downloads until its cooldown is over, and quarantine the cookie
+    set that was used. Returns None if the entry could not be downloaded,
+    and raises PermanentError if it never will be.
+
+    A shared download only stops once its ``cancel_event`` is set, not when
+    the user that started it cancels, other jobs may still be waiting for it.
+    """
+    def cancelled():
+        return cancel_event.is_set() if cancel_event is not None else is_cancelled(user_id)
+
+    for attempt in range(1, Config.DOWNLOAD_RETRIES + 1):
+        if cancelled():
+            return None
+        
+        if breaker.remaining > 0:
+            try:
+                await message.edit_text(
+                    f"⏸️ YouTube is rate limiting downloads.\n"
+                    f"Resuming in {format_time(int(breaker.remaining) + 1)}..."
+                )
+            except Exception as e:
+                # The job that started a shared download may be gone already
+                logger.error(f"Failed to show the rate limit pause: {str(e)}")
+            await breaker.wait()
+        
+        # Every attempt may go out with a different account's cookies and route
+        cookiefile = cookie_pool.acquire()
+        download_start = time.time()
         try:
-            ydl.download([video_url])
-            info = ydl.extract_info(video_url, download=False)
-            filename = ydl.prepare_filename(info)
-            return filename
+            async with connection_budget.acquire(user_id) as connections, proxy_pool.acquire() as endpoint:
+                try:
+                    # Only jobs that are actually downloading take a share of the link
+                    with bandwidth.transfer(INGRESS, user_id) as transfer:
+                        filename = await run_in_thread(functools.partial(
+                            download_func, *args,
+                            cancel_event=cancel_event,
+                            cookiefile=cookiefile,
+                            network_opts=endpoint.ydl_opts() if endpoint else None,
+                            connections=connections,
+                            rate_limit=transfer
+                        ))
+                except Exception as e:
+                    if not cancelled() and not is_permanent_error(e):
+                        proxy_pool.report_failure(endpoint, throttled=is_throttle_error(e))
+                    raise
+                proxy_pool.report_success(endpoint)
         except Exception as e:
-            logger.error(f"Error downloading video: {str(e)}")
-            return None
-
-def download_audio(video_url, download_path, format_type):
-    """Download a single video as audio with specified format (mp3 or wav)"""
+            if cancelled():
+                return None
+            if is_permanent_error(e):
+                logger.error(f"Skipping unavailable entry: {str(e)}")
+                raise PermanentError(str(e)) from e
+            if is_throttle_error(e):
+                breaker.record_throttle()
+                cookie_pool.report_throttle(cookiefile)
+            if attempt == Config.DOWNLOAD_RETRIES:
+                logger.error(f"Download failed after {attempt} attempts: {str(e)}")
+                return None
+            
+            # Exponential backoff with jitter so jobs don't retry in lockstep
+            delay = min(Config.RETRY_MAX_DELAY, Config.RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            delay *= random.uniform(0.5, 1.5)
+            logger.warning(f"Download attempt {attempt} failed, retrying in {delay:.0f}s: {str(e)}")
+            await asyncio.sleep(delay)
+            continue
+        
+        breaker.record_success()
+        if filename and os.path.exists(filename):
+            download_meter.record(os.path.getsize(filename), time.time() - download_start)
+        return filename
+    return None
+
+async def download_shared(user_id, message, key, download_path, download_func, video_url, *args):
+    """Download an entry, sharing the transfer with other jobs fetching the same key.
+
+    When several users request the same video at the same quality at once,
+    it is downloaded only once and each job gets its own link to the file
+    in its download_path.
+    """
+    async def download(directory, cancel_event):
+        return await download_entry(user_id, message, download_func, video_url, directory, *args, cancel_event=cancel_event)
+    return await flights.run(key, download_path, download)
+
+def download_audio(video_url, download_path, cancel_event=None, cookiefile=None, network_opts=None, connections=1, rate_limit=None):
+    """Download the native audio stream of a single video (transcoding happens separately)"""
     ydl_opts = {
         'format': 'bestaudio/best',
         'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
-        'cookiefile': 'cookies.txt',
-        'ignoreerrors': True,
+        'cookiefile': cookiefile,
         'no_warnings': True,
         'quiet': True,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': format_type,
-            'preferredquality': '192',
-        }],
+        **(network_opts or {}),
+        **engine_opts(connections),
     }
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            ydl.download([video_url])
-            info = ydl.extract_info(video_url, download=False)
-            filename = ydl.prepare_filename(info)
-            # Change extension to match the requested format
-            filename = os.path.splitext(filename)[0] + f".{format_type}"
-            return filename
-        except Exception as e:
-            logger.error(f"Error downloading audio: {str(e)}")
-            return None
+    return extractor.download(video_url, ydl_opts, cancel_event, rate_limit)
 
-async def download_playlist(url, user_id, quality, message):
-    """Download videos from playlist with specified quality"""
+async def download_playlist(job, message):
+    """Download videos from playlist with the job's quality"""
+    user_id = job.user_id
+    quality = job.quality
     download_path = create_download_folder(user_id)
     
     # Debug log to verify the quality parameter
     logger.info(f"Starting playlist download with quality: {quality}")
     
-    playlist_info = get_video_info(url)
+    # Delivered entries of a sync are dropped from the flat listing, before they are resolved
+    delivered = delivered_filter(user_id, job.sync_id) if job.sync_id else None
+    playlist_info = await fetch_playlist(job.url, job.items, delivered)
     if not playlist_info:
         await message.edit_text("Failed to get playlist information.")
         return False
 
+    # Pick every entry's format now and keep only that, not yt-dlp's info dicts
+    job.entries = [Entry.from_info(info, quality=quality) for info in pending_entries(job, playlist_info) if info]
     playlist_title = playlist_info.get('title', 'Playlist')
-    total_videos = len(playlist_info['entries'])
+    del playlist_info
+    total_videos = len(job.entries)
+    
+    # Reserve disk space for the whole job before writing anything
+    if not await admit_job(job, message):
+        return None
     
     await message.edit_text(
         f"📥 Downloading: {playlist_title}\n"
         f"Total videos: {total_videos}\n"
-        f"Selected quality: {quality}p\n\n"
+        f"Selected quality: {quality_label(quality)}\n\n"
         f"0/{total_videos} completed"
     )
 
     downloaded_files = []
+    downloaded_ids = []
+    # Entries that fail all their retries get one more attempt at the end of the job
+    failed_entries = []
+    unavailable = 0
     
-    for i, entry in enumerate(playlist_info['entries'], 1):
+    for i, entry in enumerate(job.entries, 1):
         # Check if process was cancelled
-        if active_processes.get(user_id, {}).get("cancelled", False):
+        if is_cancelled(user_id):
             await message.edit_text("Process cancelled by user.")
             # Clean up downloaded files
-            cleanup_path = f"downloads/{user_id}"
-            if os.path.exists(cleanup_path):
-                shutil.rmtree(cleanup_path)
+            await job.cleanup()
             return False
             
-        if entry:
-            video_title = entry.get('title', f'Video {i}')
-            video_url = entry['webpage_url']
-            
-            await message.edit_text(
-                f"📥 Downloading: {playlist_title}\n"
-                f"Total videos: {total_videos}\n"
-                f"Selected quality: {quality}p\n\n"
-                f"Downloading {i}/{total_videos}: {video_title}"
-            )
-            
-            filename = download_video(video_url, download_path, quality)
+        video_title = entry.title or f'Video {i}'
+        
+        await message.edit_text(
+            f"📥 Downloading: {playlist_title}\n"
+            f"Total videos: {total_videos}\n"
+            f"Selected quality: {quality_label(quality)}\n\n"
+            f"Downloading {i}/{total_videos}: {video_title}"
+        )
+        
+        try:
+            filename = await download_shared(user_id, message, (entry.key, quality),
+                                             download_path, download_video, entry.url, entry)
+        except PermanentError:
+            # Retrying won't bring it back, so it stays out of the retry pass
+            unavailable += 1
+        else:
             if filename:
                 downloaded_files.append(filename)
-            
-            await message.edit_text(
-                f"📥 Downloading: {playlist_title}\n"
-                f"Total videos: {total_videos}\n"
-                f"Selected quality: {quality}p\n\n"
-                f"{i}/{total_videos} completed"
-            )
+                downloaded_ids.append(entry.id)
+            else:
+                failed_entries.append(entry)
+        
+        await message.edit_text(
+            f"📥 Downloading: {playlist_title}\n"
+            f"Total videos: {total_videos}\n"
+            f"Selected quality: {quality_label(quality)}\n\n"
+            f"{i}/{total_videos} completed"
+        )
+
+    # Retry failed entries once more now that any throttling has had time to pass
+    for i, entry in enumerate(list(failed_entries), 1):
+        if is_cancelled(user_id):
+            return False
+        
+        await message.edit_text(
+            f"📥 Downloading: {playlist_title}\n"
+            f"Total videos: {total_videos}\n"
+            f"Selected quality: {quality_label(quality)}\n\n"
+            f"🔁 Retrying failed video {i}/{len(failed_entries)}: {entry.title or 'Unknown'}"
+        )
+        
+        try:
+            filename = await download_shared(user_id, message, (entry.key, quality),
+                                             download_path, download_video, entry.url, entry)
+        except PermanentError:
+            continue
+        if filename:
+            downloaded_files.append(filename)
+            downloaded_ids.append(entry.id)
+            failed_entries.remove(entry)
 
     # Show upload options after download is complete
     if downloaded_files:
@@ -465,19 +922,24 @@ async def download_playlist(url, user_id, quality, message):
             [InlineKeyboardButton("❌ Cancel", callback_data="cancel_process")]
         ])
         
+        failed_count = len(failed_entries) + unavailable
+        failed_line = f"⚠️ Failed: {failed_count}\n" if failed_count else ""
         await message.edit_text(
             f"✅ Download completed!\n"
             f"Playlist: {playlist_title}\n"
-            f"Total files: {len(downloaded_files)}\n\n"
+            f"Total files: {len(downloaded_files)}\n"
+            f"{failed_line}\n"
             f"Please select where to upload:\n"
             f"ZIP Mode: Off",
             reply_markup=upload_keyboard
         )
         
         # Store download info for later use
-        user_data[user_id]['files'] = downloaded_files
-        user_data[user_id]['playlist_title'] = playlist_title
-        user_data[user_id]['zip_mode'] = False
+        job.files = downloaded_files
+        job.entry_ids = downloaded_ids
+        job.title = playlist_title
+        job.zip_mode = False
+        job.save()
         
         return True
     else:
@@ -485,7 +947,7 @@ async def download_playlist(url, user_id, quality, message):
         return False
 
 async def upload_videos_to_telegram(user_id, files, playlist_title, message):
-    """Upload downloaded videos to Telegram"""
+    """Upload downloaded videos to Telegram, returns the files that were delivered"""
     # Add cancel button to the status message
     cancel_button = InlineKeyboardMarkup([
         [InlineKeyboardButton("❌ Cancel Process", callback_data="cancel_process")]
@@ -504,17 +966,17 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
     )
     
     # Check if we're dealing with audio files
-    is_audio = user_data.get(user_id, {}).get('is_audio', False)
+    job = user_jobs.current(user_id)
+    is_audio = job.is_audio
+    uploaded = []
     
     for i, file_path in enumerate(files, 1):
         # Check if process was cancelled
-        if active_processes.get(user_id, {}).get("cancelled", False):
+        if is_cancelled(user_id):
             await message.edit_text("Process cancelled by user.")
             # Clean up downloaded files
-            cleanup_path = f"downloads/{user_id}"
-            if os.path.exists(cleanup_path):
-                shutil.rmtree(cleanup_path)
-            return
+            await user_jobs.current(user_id).cleanup()
+            return uploaded
             
         try:
             filename = os.path.basename(file_path)
@@ -560,6 +1022,9 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
                     
                     # Delete progress message after upload
                     await progress_message.delete()
+                    upload_meter.record(os.path.getsize(file_path), time.time() - start_time)
+                    uploaded.append(file_path)
+                    await release_delivered_file(user_id, file_path)
                 else:
                     # For videos, use the existing split video function
                     # Save the original message text to restore later
@@ -567,7 +1032,8 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
                                     f"File {i}/{len(files)}: {filename}\n\n"
                     
                     # Split the video into parts
-                    split_files = await split_video(file_path, user_id, message)
+                    with stage_seconds.time(stage='split'):
+                        split_files = await split_video(file_path, user_id, message)
                     
                     if not split_files:
                         await app.send_message(user_id, f"Failed to split large file: {filename}")
@@ -621,11 +1087,15 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
                         
                         # Delete progress message after upload
                         await progress_message.delete()
+                        upload_meter.record(os.path.getsize(part_file), time.time() - start_time)
 
                         # Add 4-second delay between uploads to avoid flood wait
                         if part_index < len(split_files):
                             await asyncio.sleep(Config.UPLOAD_INTERVAL)
                     
+                    uploaded.append(file_path)
+                    await release_delivered_file(user_id, file_path)
+                    
                     # Update status after all parts are uploaded
                     await message.edit_text(
                         f"📤 Uploading: {playlist_title}\n"
@@ -676,6 +1146,9 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
                 
                 # Delete progress message after upload
                 await progress_message.delete()
+                upload_meter.record(os.path.getsize(file_path), time.time() - start_time)
+                uploaded.append(file_path)
+                await release_delivered_file(user_id, file_path)
                 
                 # Update main status message
                 await message.edit_text(
@@ -706,19 +1179,15 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
                     pass
                 
                 logger.info(f"Got FLOOD_WAIT, waiting for {wait_time} seconds")
+                record_flood_wait(wait_time)
                 await message.edit_text(
                     f"Rate limit hit. Waiting for {wait_time} seconds before continuing...",
                     reply_markup=cancel_button
                 )
                 await asyncio.sleep(wait_time)
 
-    # Remove user from active processes
-    active_processes.pop(user_id, None)
-    
-    # Clean up split files directory if it exists
-    split_dir = f"downloads/{user_id}/split"
-    if os.path.exists(split_dir):
-        shutil.rmtree(split_dir)
+    # Clean up split parts and anything that failed to upload
+    await job.cleanup()
     
     await message.edit_text(
         f"✅ Process completed!\n"
@@ -727,11 +1196,10 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
     )
     # Log successful Telegram upload
     try:
-        user = await app.get_users(user_id)
-        user_mention = f"@{user.username}" if user.username else f"[{user.first_name}](tg://user?id={user_id})"
+        user_mention = await profiles.mention(app, user_id)
         
-        # Get the original URL from user_data
-        original_url = user_data.get(user_id, {}).get('url', 'Unknown URL')
+        # Get the original URL from the user's session
+        original_url = job.url or 'Unknown URL'
         
         log_message = (
             "#PlaylistBotLogs \n"
@@ -742,15 +1210,16 @@ async def upload_videos_to_telegram(user_id, files, playlist_title, message):
             f"📁 Files: {len(files)}\n"
             f"🔗 YouTube URL: {original_url}"
         )
-        await send_log(log_message)
+        send_log(log_message)
     except Exception as e:
         logger.error(f"Failed to send upload completion log: {str(e)}")
+    return uploaded
 
 async def upload_to_gofile(file_path, message, current_video_title, folder_id=None):
     """Upload a file to GoFile"""
     try:
         server_url = "https://api.gofile.io/servers"
-        server_response = requests.get(server_url)
+        server_response = await asyncio.to_thread(requests.get, server_url)
         
         if server_response.status_code != 200:
             raise Exception(f"Failed to get server. Status code: {server_response.status_code}")
@@ -771,11 +1240,27 @@ async def upload_to_gofile(file_path, message, current_video_title, folder_id=No
         update_interval = 5  # Reduced to 5 seconds for more frequent updates
         last_progress_text = ""  # Track the last progress text to avoid duplicate updates
 
+        user_id = message.chat.id
+        cancel_event = jobs.cancel_event(user_id)
+        job = user_jobs.current(user_id)
+
         # Progress callback function with improved error handling
         def progress_callback(monitor):
             nonlocal last_update_time, last_progress_text
             current_time = time.time()
             
+            # Checked on every chunk so a cancel stops the stream immediately
+            if cancel_event.is_set() or job.upload_cancelled(message.id):
+                print("Upload cancelled by user")
+                # Its own exception type, urllib3 reads the body in a generator
+                # and would turn a StopIteration into a RuntimeError
+                raise UploadCancelled("Upload cancelled by user")
+            
+            # Pace the stream to this job's share of the upload bandwidth
+            transfer = bandwidth.get(EGRESS, user_id)
+            if transfer:
+                time.sleep(transfer.delay(monitor.bytes_read))
+            
             if current_time - last_update_time >= update_interval:
                 try:
                     percentage = (monitor.bytes_read * 100) / monitor.len
@@ -827,21 +1312,8 @@ async def upload_to_gofile(file_path, message, current_video_title, folder_id=No
                         except Exception as e:
                             # Just log the error but don't stop the upload
                             print(f"Failed to update progress: {str(e)}")
-                            
-                    # Check if upload was cancelled
-                    if upload_cancelled.get(message.id, False):
-                        print("Upload cancelled by user")
-                        try:
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                        except Exception as e:
-                            print(f"Error cleaning up file: {str(e)}")
-                        # Raise StopIteration to actually stop the upload
-                        raise StopIteration("Upload cancelled by user")
 
                     last_update_time = current_time
-                except StopIteration:
-                    raise
                 except Exception as e:
                     print(f"Progress update error: {str(e)}")
 
@@ -859,25 +1331,32 @@ async def upload_to_gofile(file_path, message, current_video_title, folder_id=No
             encoder = MultipartEncoder(fields=fields)
             monitor = MultipartEncoderMonitor(encoder, callback=progress_callback)
 
-            try:
-                response = requests.post(
-                    upload_url,
-                    data=monitor,
-                    headers={'Content-Type': monitor.content_type,
-                            'Authorization': f"Bearer {token}"},
-                    timeout=3600
-                )
-            except StopIteration:
-                print("Upload stopped by user")
+            def post_upload():
+                try:
+                    return requests.post(
+                        upload_url,
+                        data=monitor,
+                        headers={'Content-Type': monitor.content_type,
+                                'Authorization': f"Bearer {token}"},
+                        timeout=3600
+                    )
+                except UploadCancelled:
+                    print("Upload stopped by user")
+                    return None
+
+            # Stream the body from a worker thread so the event loop keeps running
+            response = await run_in_thread(post_upload)
+            if response is None:
                 return None
 
             # Check if cancelled after upload
-            if upload_cancelled.get(message.id, False):
+            if cancel_event.is_set() or job.upload_cancelled(message.id):
                 print("Upload cancelled by user")
                 return None
                 
             if response.status_code != 200:
                 raise Exception(f"Upload failed with status code: {response.status_code}, Response: {response.text}")
+            upload_meter.record(file_size, time.time() - start_time)
 
             result = response.json()
             
@@ -885,14 +1364,14 @@ async def upload_to_gofile(file_path, message, current_video_title, folder_id=No
                 return result["data"]
             else:
                 print(f"Unexpected response format: {result}")
+                gofile_errors.inc(operation='upload')
                 return None
 
-        except Exception as e:
-            if "Upload cancelled by user" in str(e):
-                return None
-            raise
+        except UploadCancelled:
+            return None
     except Exception as e:
         print(f"GoFile upload error: {str(e)}")
+        gofile_errors.inc(operation='upload')
         return None
     finally:
         try:
@@ -910,7 +1389,7 @@ async def create_gofile_folder(name, token):
             "Authorization": f"Bearer {token}"
         }
         
-        account_response = requests.get(account_id_url, headers=headers)
+        account_response = await asyncio.to_thread(requests.get, account_id_url, headers=headers)
         
         if account_response.status_code != 200:
             raise Exception(f"Failed to get account ID. Status code: {account_response.status_code}, Response: {account_response.text}")
@@ -925,7 +1404,7 @@ async def create_gofile_folder(name, token):
         
         # Get the root folder ID for this account
         account_details_url = f"https://api.gofile.io/accounts/{account_id}"
-        account_details_response = requests.get(account_details_url, headers=headers)
+        account_details_response = await asyncio.to_thread(requests.get, account_details_url, headers=headers)
         
         if account_details_response.status_code != 200:
             raise Exception(f"Failed to get account details. Status code: {account_details_response.status_code}")
@@ -951,7 +1430,7 @@ async def create_gofile_folder(name, token):
         
         print(f"Creating folder with data: {data}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = await asyncio.to_thread(requests.post, url, headers=headers, json=data)
         
         if response.status_code != 200:
             raise Exception(f"Failed to create folder. Status code: {response.status_code}, Response: {response.text}")
@@ -964,10 +1443,12 @@ async def create_gofile_folder(name, token):
             raise Exception(f"Failed to create folder: {result.get('message', 'Unknown error')}")
     except Exception as e:
         print(f"Error creating GoFile folder: {str(e)}")
+        gofile_errors.inc(operation='folder')
         return None
 
 async def upload_files_to_gofile(user_id, files, playlist_title, message):
-    """Upload all downloaded files to GoFile"""
+    """Upload all downloaded files to GoFile, returns the files that were delivered"""
+    job = user_jobs.current(user_id)
     # Add cancel button to the status message
     cancel_button = InlineKeyboardMarkup([
         [InlineKeyboardButton("❌ Cancel Process", callback_data="cancel_process")]
@@ -990,7 +1471,7 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
             f"❌ Failed to create folder on GoFile.\n"
             f"Please try again later."
         )
-        return
+        return []
     
     # Track uploaded files and their links
     uploaded_files = []
@@ -998,13 +1479,11 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
     
     for i, file_path in enumerate(files, 1):
         # Check if process was cancelled
-        if active_processes.get(user_id, {}).get("cancelled", False):
+        if is_cancelled(user_id):
             await message.edit_text("Process cancelled by user.")
             # Clean up downloaded files
-            cleanup_path = f"downloads/{user_id}"
-            if os.path.exists(cleanup_path):
-                shutil.rmtree(cleanup_path)
-            return
+            await user_jobs.current(user_id).cleanup()
+            return uploaded_files
             
         try:
             filename = os.path.basename(file_path)
@@ -1021,7 +1500,8 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
             result = await upload_to_gofile(file_path, message, filename, folder_id)
             
             if result:
-                uploaded_files.append(filename)
+                uploaded_files.append(file_path)
+                await release_delivered_file(user_id, file_path)
                 # Store folder link from the first successful upload
                 if not folder_link and "parentFolder" in result:
                     # Fix: Check if parentFolder is a dictionary and has directLink
@@ -1053,13 +1533,8 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
             logger.error(f"Error uploading file to GoFile {file_path}: {str(e)}")
             await app.send_message(user_id, f"Failed to upload {filename} to GoFile: {str(e)}")
     
-    # Remove user from active processes
-    active_processes.pop(user_id, None)
-    
     # Clean up downloaded files
-    cleanup_path = f"downloads/{user_id}"
-    if os.path.exists(cleanup_path):
-        shutil.rmtree(cleanup_path)
+    await job.cleanup()
     
     # Final message with folder link
     if not folder_link and len(uploaded_files) > 0 and "parentFolderCode" in result:
@@ -1075,11 +1550,10 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
         )
          # Log successful GoFile upload
         try:
-            user = await app.get_users(user_id)
-            user_mention = f"@{user.username}" if user.username else f"[{user.first_name}](tg://user?id={user_id})"
+            user_mention = await profiles.mention(app, user_id)
             
-            # Get the original URL from user_data
-            original_url = user_data.get(user_id, {}).get('url', 'Unknown URL')
+            # Get the original URL from the user's session
+            original_url = job.url or 'Unknown URL'
             
             log_message = (
                 "#PlaylistBotLogs \n"
@@ -1091,7 +1565,7 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
                 f"🔗 YouTube URL: {original_url}\n"
                 f"📥 GoFile Link: {folder_link}"
             )
-            await send_log(log_message)
+            send_log(log_message)
         except Exception as e:
             logger.error(f"Failed to send upload completion log: {str(e)}")
     else:
@@ -1102,8 +1576,7 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
         )
         # Log failed upload
         try:
-            user = await app.get_users(user_id)
-            user_mention = f"@{user.username}" if user.username else f"[{user.first_name}](tg://user?id={user_id})"
+            user_mention = await profiles.mention(app, user_id)
             log_message = (
                 "#PlaylistBotLogs \n"
                 f"❌ GoFile upload failed!\n"
@@ -1111,31 +1584,65 @@ async def upload_files_to_gofile(user_id, files, playlist_title, message):
                 f"🆔 ID: `{user_id}`\n"
                 f"📋 Playlist: {playlist_title}"
             )
-            await send_log(log_message)
+            send_log(log_message, important=True)
         except Exception as e:
             logger.error(f"Failed to send upload failure log: {str(e)}")
+    return uploaded_files
 
 @app.on_callback_query(filters.regex(r'^cancel_process$'))
 async def cancel_process(client, callback_query):
     user_id = callback_query.from_user.id
     
-    if user_id in active_processes:
-        active_processes[user_id]["cancelled"] = True
-        # Immediately update the message to show cancellation
-        await callback_query.message.edit_text("Process cancelled by user.")
+    if job_queue:
+        # Downloaded files waiting for an upload choice count as a process too
+        job = user_jobs.get(user_id)
+        if job_queue.cancel(user_id) or (job and job.files):
+            await callback_query.message.edit_text("Cancelling process...")
+            await callback_query.answer("Cancelling process...")
+            # The worker holding the user's files stops the job and cleans up after it
+            dispatch(user_id, 'cleanup', callback_query.message, pinned=True)
+        else:
+            await callback_query.answer("No active process to cancel.")
+        return
+    
+    job = user_jobs.current(user_id)
+    if job.active or jobs.is_running(user_id):
+        job.cancelled = True
+        # Signal every stage of the job and interrupt whatever it is awaiting
+        task = jobs.cancel(user_id)
         
-        # Clean up downloaded files
-        cleanup_path = f"downloads/{user_id}"
-        if os.path.exists(cleanup_path):
-            shutil.rmtree(cleanup_path)
-            
-        # Remove from active processes
-        active_processes.pop(user_id, None)
+        await callback_query.message.edit_text("Cancelling process...")
+        await callback_query.answer("Cancelling process...")
         
-        await callback_query.answer("Process cancelled successfully.")
+        # Let the job stop its transfers before its files are removed, supervised
+        # like any job so a failing cleanup is reported and blocks new requests
+        jobs.start(user_id, finish_cancel(user_id, task, callback_query.message), "cancel cleanup",
+                   on_error=job_error_reporter(user_id, callback_query.message))
     else:
         await callback_query.answer("No active process to cancel.")
 
+async def finish_cancel(user_id, task, message):
+    """Wait for a cancelled job to unwind, then clean up after it"""
+    if task is not None:
+        await asyncio.wait([task], timeout=10)
+    
+    # Clean up downloaded files
+    await user_jobs.current(user_id).cleanup()
+    
+    try:
+        await message.edit_text("Process cancelled by user.")
+    except Exception as e:
+        logger.error(f"Failed to update cancelled message: {str(e)}")
+
+@app.on_message(group=-1)
+async def remember_sender(client, message):
+    """Cache the sender's profile for mentions, the message still goes to the other handlers"""
+    profiles.remember(message.from_user)
+
+@app.on_callback_query(group=-1)
+async def remember_callback_sender(client, callback_query):
+    profiles.remember(callback_query.from_user)
+
 @app.on_message(filters.command("start"))
 async def start_command(client, message):
     user_id = message.from_user.id
@@ -1143,7 +1650,9 @@ async def start_command(client, message):
     if is_authorized(user_id):
         await message.reply_text(
             "Welcome to YouTube Playlist Downloader Bot!\n\n"
-            "Send me a YouTube playlist URL and I'll help you download it."
+            "Send me a YouTube playlist URL and I'll help you download it.\n\n"
+            "Add a range after the link (e.g. `10-40` or `last 20`) to get only part of it, "
+            "or send several links or a .txt file of links to download them as one job."
         )
     else:
         # Create an inline keyboard with admin contact link
@@ -1151,9 +1660,9 @@ async def start_command(client, message):
             [InlineKeyboardButton("Contact Admin", url=f"https://t.me/{Config.ADMIN_USERNAME}")]
         ])
          # Log unauthorized access attempt
-        user_mention = f"@{message.from_user.username}" if message.from_user.username else f"[{message.from_user.first_name}](tg://user?id={user_id})"
+        user_mention = await profiles.mention(app, user_id)
         log_message = "#PlaylistBotLogs \n" f"⚠️ Unauthorized access attempt!\n👤 User: {user_mention}\n🆔 ID: `{user_id}`"
-        await send_log(log_message)
+        send_log(log_message, important=True)
         
         await message.reply_text(
             "You are not authorized to use this bot.\n"
@@ -1162,10 +1671,94 @@ async def start_command(client, message):
             link_preview_options=LinkPreviewOptions(is_disabled=True)
         )
 
-@app.on_message(filters.regex(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'))
+# Audio formats and video qualities offered by the picker
+AUDIO_OPTIONS = ('mp3', 'wav', 'flac', 'native')
+QUALITY_OPTIONS = ('144', '240', '360', '480', '720', '1080', '2160', 'auto')
+
+def estimate_options(entries):
+    """Expected download size of the entries for every option in the picker"""
+    estimates = {audio_format: estimate_total_size(entries, audio_format=audio_format) for audio_format in AUDIO_OPTIONS}
+    estimates.update({quality: estimate_total_size(entries, quality) for quality in QUALITY_OPTIONS})
+    return estimates
+
+def build_quality_keyboard(estimates):
+    """Quality picker showing the estimated size and total time of each option"""
+    def option(text, callback_data, quality=None, audio_format=None):
+        size = estimates.get(audio_format or quality)
+        if size:
+            seconds = download_meter.estimate(size) + upload_meter.estimate(size)
+            text = f"{text} · {format_size(size)} · ~{format_time(int(seconds))}"
+        return InlineKeyboardButton(text, callback_data=callback_data)
+
+    return InlineKeyboardMarkup([
+        [
+            option("🎵 MP3", "format_mp3", audio_format='mp3'),
+            option("🎵 WAV", "format_wav", audio_format='wav')
+        ],
+        [
+            option("🎵 FLAC", "format_flac", audio_format='flac'),
+            option("🎵 Original", "format_native", audio_format='native')
+        ],
+        [option("144p", "quality_144", quality='144')],
+        [option("240p", "quality_240", quality='240')],
+        [option("360p", "quality_360", quality='360')],
+        [option("480p", "quality_480", quality='480')],
+        [option("720p", "quality_720", quality='720')],
+        [option("1080p", "quality_1080", quality='1080')],
+        [option("2160p (4K)", "quality_2160", quality='2160')],
+        [option("🤖 Auto (no splitting)", "quality_auto", quality='auto')],
+        [InlineKeyboardButton("❌ Cancel", callback_data="cancel_process")]
+    ])
+
+@app.on_message(filters.regex(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+') & ~filters.regex(r'^/'))
 async def handle_url(client, message):
-    url = message.text.strip()
+    # One link, optionally followed by a range, or several links as one job
+    urls = list(dict.fromkeys(URL_PATTERN.findall(message.text)))
+    items = None
+    if len(urls) == 1:
+        range_text = URL_PATTERN.sub('', message.text).strip()
+        items = parse_playlist_items(range_text) if range_text else None
+        if range_text and not items:
+            await message.reply_text(
+                "❌ I couldn't understand that range.\n"
+                "Send the link followed by a range like `10-40`, `10-`, `first 10` or `last 20`."
+            )
+            return
+    
+    await submit_urls(message, urls[0] if len(urls) == 1 else urls, items)
+
+@app.on_message(filters.document)
+async def handle_url_file(client, message):
+    """Bulk mode: every link in an uploaded .txt file becomes one job"""
+    if not (message.document.file_name or '').lower().endswith('.txt'):
+        return
+    
+    file_size = message.document.file_size or 0
+    if not is_authorized(message.from_user.id):
+        # submit_urls turns them away, the file itself is never downloaded
+        await submit_urls(message, f"{message.document.file_name} ({format_size(file_size)})")
+        return
+    
+    if file_size > MAX_URL_FILE_SIZE:
+        await message.reply_text(f"❌ This file is too large, link files can be up to {format_size(MAX_URL_FILE_SIZE)}.")
+        return
+    
+    data = await message.download(in_memory=True)
+    text = bytes(data.getbuffer()).decode('utf-8', errors='ignore')
+    # Skip comment lines, e.g. the header of an exported cookies file
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith('#')]
+    urls = list(dict.fromkeys(URL_PATTERN.findall("\n".join(lines))))
+    if not urls:
+        await message.reply_text("❌ No links found in this file.")
+        return
+    
+    await submit_urls(message, urls[0] if len(urls) == 1 else urls)
+
+async def submit_urls(message, url, items=None):
+    """Start probing a URL (or a list of URLs for a bulk job) for the sender"""
     user_id = message.from_user.id
+    url_text = url if isinstance(url, str) else "\n".join(url)
+    user_mention = await profiles.mention(app, user_id)
 
      # Check if user is authorized
     if not is_authorized(user_id):
@@ -1175,9 +1768,8 @@ async def handle_url(client, message):
         ])
 
         # Log unauthorized access attempt
-        user_mention = f"@{message.from_user.username}" if message.from_user.username else f"[{message.from_user.first_name}](tg://user?id={user_id})"
-        log_message = "#PlaylistBotLogs \n" f"⚠️ Unauthorized URL request!\n👤 User: {user_mention}\n🆔 ID: `{user_id}`\n🔗 URL: {url}"
-        await send_log(log_message)
+        log_message = "#PlaylistBotLogs \n" f"⚠️ Unauthorized URL request!\n👤 User: {user_mention}\n🆔 ID: `{user_id}`\n🔗 URL: {url_text}"
+        send_log(log_message, important=True)
         
         await message.reply_text(
             "You are not authorized to use this bot.\n"
@@ -1188,66 +1780,109 @@ async def handle_url(client, message):
         return
 
     # Check if user already has an active process
-    if user_id in active_processes and not active_processes[user_id].get("cancelled", False):
+    if has_active_process(user_id):
         await message.reply_text(
             "⚠️ You already have an active download process.\n"
             "Please wait for it to complete or cancel it before starting a new one."
         )
         return
 
-    status_message = await message.reply_text("Checking Playlist URL, it'll take some time \n ⌛ Please Wait...")
+    if isinstance(url, str):
+        status_message = await message.reply_text("Checking Playlist URL, it'll take some time \n ⌛ Please Wait...")
+    else:
+        status_message = await message.reply_text(f"Checking {len(url)} links, it'll take some time \n ⌛ Please Wait...")
     # Store the message ID for potential cancellation
-    active_processes[user_id] = {"status_message_id": status_message.id, "cancelled": False}
+    user_jobs.current(user_id).start(status_message.id)
+    
+    # Fetch the playlist in the background so this handler returns immediately
+    dispatch(user_id, 'probe', status_message, url=url, items=items, mention=user_mention)
+
+async def probe_playlist(user_id, user_mention, url, status_message, sync=False, items=None, schedule=None):
+    """Background job: fetch playlist info and show the quality picker.
+
+    ``url`` may be a list of URLs for a bulk job, and ``items`` a
+    playlist_items range so only the selected entries are resolved. In sync
+    mode only entries missing from the user's sync archive are offered.
+    A scheduled sync passes its subscription as ``schedule`` and goes
+    straight on to download and upload them with the options saved there.
+    """
+    job = user_jobs.current(user_id)
     
-    playlist_info = get_video_info(url)
+    delivered = delivered_filter(user_id, url=url) if sync else None
+    playlist_info = await fetch_playlist(url, items, delivered)
     if not playlist_info:
         await status_message.edit_text("Invalid URL or couldn't fetch playlist information.")
-        active_processes.pop(user_id, None)
+        job.finish()
         return
     
-    user_data[user_id] = {'url': url}
+    await job.reset(url=url, items=items)
+    playlist_title = playlist_info.get('title', 'Unknown Playlist')
+    total_videos = len(playlist_info['entries']) + playlist_info.get('skipped_delivered', 0)
     
-    keyboard = InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("🎵 MP3", callback_data="format_mp3"),
-            InlineKeyboardButton("🎵 WAV", callback_data="format_wav")
-        ],
-        [
-            InlineKeyboardButton("144p", callback_data="quality_144"),
-            InlineKeyboardButton("240p", callback_data="quality_240")
-        ],
-        [
-            InlineKeyboardButton("360p", callback_data="quality_360"),
-            InlineKeyboardButton("480p", callback_data="quality_480")
-        ],
-        [
-            InlineKeyboardButton("720p", callback_data="quality_720"),
-            InlineKeyboardButton("1080p", callback_data="quality_1080")
-        ],
-        [
-            InlineKeyboardButton("2160p (4K)", callback_data="quality_2160")
-        ],
-        [InlineKeyboardButton("❌ Cancel", callback_data="cancel_process")]
-    ])
+    entries = playlist_info['entries']
+    videos_line = f"📊 Total videos: {total_videos}"
+    if sync:
+        job.sync_id = playlist_info.get('id') or url
+        job.save()
+        entries = pending_entries(job, playlist_info)
+        if not entries:
+            await status_message.edit_text(
+                f"✅ {playlist_title} is up to date.\n"
+                f"No new videos since the last sync."
+            )
+            job.finish()
+            return
+        videos_line = f"🆕 New videos: {len(entries)} of {total_videos}"
     
-    playlist_title = playlist_info.get('title', 'Unknown Playlist')
-    total_videos = len(playlist_info['entries'])
+    if not entries:
+        await status_message.edit_text("❌ None of the videos in this playlist are available.")
+        job.finish()
+        return
+    
+    # Kept with the job so a queued download can be ordered by its size
+    job.estimates = estimate_options(entries)
+    job.save()
+    keyboard = build_quality_keyboard(job.estimates)
+    
+    skipped = []
+    if playlist_info.get('skipped_duplicates'):
+        skipped.append(f"{playlist_info['skipped_duplicates']} duplicates")
+    if playlist_info.get('skipped_unavailable'):
+        skipped.append(f"{playlist_info['skipped_unavailable']} unavailable or private")
+    if skipped:
+        videos_line += f"\n⏭️ Skipped: {', '.join(skipped)}"
     
-    user_mention = f"@{message.from_user.username}" if message.from_user.username else f"[{message.from_user.first_name}](tg://user?id={user_id})"
+    url_text = url if isinstance(url, str) else "\n".join(url)
     log_message = (
         "#PlaylistBotLogs \n"
         f"🚀 New download task started!\n"
         f"👤 User: {user_mention}\n"
         f"🆔 ID: `{user_id}`\n"
         f"📋 Playlist: {playlist_title}\n"
-        f"📊 Videos: {total_videos}\n"
-        f"🔗 URL: {url}"
+        f"📊 Videos: {len(entries)}{' new (sync)' if sync else ''}\n"
+        f"🔗 URL: {url_text}"
     )
-    await send_log(log_message)
+    send_log(log_message)
+    
+    if schedule:
+        job.quality = schedule['quality']
+        job.audio_format = schedule['audio_format']
+        job.save()
+        option = job.audio_format.upper() if job.is_audio else quality_label(job.quality)
+        await status_message.edit_text(
+            f"📋 Playlist: {playlist_title}\n"
+            f"{videos_line}\n\n"
+            f"Downloading as {option}, then uploading to {schedule['upload_type'].capitalize()}..."
+        )
+        dispatch(user_id, 'download', status_message, upload=(schedule['upload_type'], schedule['zip_mode']))
+        return
 
     await status_message.edit_text(
         f"📋 Playlist: {playlist_title}\n"
-        f"📊 Total videos: {total_videos}\n\n"
+        f"{videos_line}\n\n"
+        f"Estimated size and download + upload time are shown for each option "
+        f"(recent speed: {format_size(download_meter.bytes_per_second)}/s down, "
+        f"{format_size(upload_meter.bytes_per_second)}/s up).\n\n"
         f"Please select download quality:",
         reply_markup=keyboard
     )
@@ -1261,41 +1896,58 @@ async def handle_format_selection(client, callback_query: CallbackQuery):
     if data.startswith("format_"):
         format_type = data.split('_')[1]
         
-        if user_id not in user_data:
+        job = user_jobs.get(user_id)
+        if job is None or not job.url:
             await callback_query.answer("Session expired. Please send the URL again.")
             return
         
-        url = user_data[user_id]['url']
-        user_data[user_id]['format_type'] = format_type
+        if job_running(user_id):
+            await callback_query.answer("A download is already running.")
+            return
         
-        # Make sure user is in active processes
-        if user_id not in active_processes:
-            active_processes[user_id] = {"status_message_id": callback_query.message.id, "cancelled": False}
+        await callback_query.answer()
+        job.quality = None
+        job.audio_format = format_type
+        job.save()
         
-        await callback_query.message.edit_text(
-            f"Starting download process with {format_type.upper()} audio format..."
-        )
+        # Make sure the job has a status message
+        if not job.active:
+            job.start(callback_query.message.id)
         
-        # Download the playlist as audio
-        result = await download_playlist_audio(url, user_id, format_type, callback_query.message)
+        if format_type == 'native':
+            await callback_query.message.edit_text(
+                "Starting download process with original audio (no re-encoding)..."
+            )
+        else:
+            await callback_query.message.edit_text(
+                f"Starting download process with {format_type.upper()} audio format..."
+            )
         
-        # If download failed or was cancelled
-        if not result:
-            if not active_processes.get(user_id, {}).get("cancelled", False):
-                await callback_query.message.edit_text("Download failed. Please try again.")
-            active_processes.pop(user_id, None)
+        # Download the playlist as audio in the background
+        dispatch(user_id, 'download', callback_query.message)
 
-async def download_playlist_audio(url, user_id, format_type, message):
-    """Download videos from playlist as audio files with specified format"""
+async def download_playlist_audio(job, message):
+    """Download videos from playlist as audio files in the job's format"""
+    user_id = job.user_id
+    format_type = job.audio_format
     download_path = create_download_folder(user_id)
     
-    playlist_info = get_video_info(url)
+    # Delivered entries of a sync are dropped from the flat listing, before they are resolved
+    delivered = delivered_filter(user_id, job.sync_id) if job.sync_id else None
+    playlist_info = await fetch_playlist(job.url, job.items, delivered)
     if not playlist_info:
         await message.edit_text("Failed to get playlist information.")
         return False
 
+    # Keep only what the pipeline needs of each entry, not yt-dlp's info dicts
+    job.entries = [Entry.from_info(info, audio_format=format_type) for info in pending_entries(job, playlist_info) if info]
     playlist_title = playlist_info.get('title', 'Playlist')
-    total_videos = len(playlist_info['entries'])
+    del playlist_info
+    total_videos = len(job.entries)
+    
+    # Reserve disk space for the whole job before writing anything
+    if not await admit_job(job, message):
+        return None
     
     await message.edit_text(
         f"📥 Downloading: {playlist_title}\n"
@@ -1304,33 +1956,52 @@ async def download_playlist_audio(url, user_id, format_type, message):
         f"0/{total_videos} completed"
     )
 
-    downloaded_files = []
+    # Each finished download is handed to the transcoding stage while the next one downloads
+    transcode_tasks = []
+    track_ids = []
+    # Entries that fail all their retries get one more attempt at the end of the job
+    failed_entries = []
+    unavailable = 0
     
-    for i, entry in enumerate(playlist_info['entries'], 1):
-        # Check if process was cancelled
-        if active_processes.get(user_id, {}).get("cancelled", False):
-            await message.edit_text("Process cancelled by user.")
-            # Clean up downloaded files
-            cleanup_path = f"downloads/{user_id}"
-            if os.path.exists(cleanup_path):
-                shutil.rmtree(cleanup_path)
-            return False
-            
-        if entry:
-            track_title = entry.get('title', f'Track {i}')
-            video_url = entry['webpage_url']
+    async def stop_encoders():
+        for task in transcode_tasks:
+            task.cancel()
+        # Wait for them to kill ffmpeg before anything removes their files
+        await asyncio.gather(*transcode_tasks, return_exceptions=True)
+    
+    try:
+        for i, entry in enumerate(job.entries, 1):
+            # Check if process was cancelled
+            if is_cancelled(user_id):
+                await stop_encoders()
+                await message.edit_text("Process cancelled by user.")
+                # Clean up downloaded files
+                await job.cleanup()
+                return False
             
+            track_title = entry.title or f'Track {i}'
+        
             await message.edit_text(
                 f"📥 Downloading: {playlist_title}\n"
                 f"Total tracks: {total_videos}\n"
                 f"Selected format: {format_type.upper()}\n\n"
                 f"Downloading {i}/{total_videos}: {track_title}"
             )
-            
-            filename = download_audio(video_url, download_path, format_type)
-            if filename:
-                downloaded_files.append(filename)
-            
+        
+            # Every audio format is transcoded from the same native stream
+            try:
+                filename = await download_shared(user_id, message, (entry.key, 'audio'),
+                                                 download_path, download_audio, entry.url)
+            except PermanentError:
+                # Retrying won't bring it back, so it stays out of the retry pass
+                unavailable += 1
+            else:
+                if filename:
+                    transcode_tasks.append(asyncio.create_task(transcode_audio(filename, format_type)))
+                    track_ids.append(entry.id)
+                else:
+                    failed_entries.append(entry)
+        
             await message.edit_text(
                 f"📥 Downloading: {playlist_title}\n"
                 f"Total tracks: {total_videos}\n"
@@ -1338,6 +2009,45 @@ async def download_playlist_audio(url, user_id, format_type, message):
                 f"{i}/{total_videos} completed"
             )
 
+        # Retry failed entries once more now that any throttling has had time to pass
+        for i, entry in enumerate(list(failed_entries), 1):
+            if is_cancelled(user_id):
+                await stop_encoders()
+                await message.edit_text("Process cancelled by user.")
+                await job.cleanup()
+                return False
+        
+            await message.edit_text(
+                f"📥 Downloading: {playlist_title}\n"
+                f"Total tracks: {total_videos}\n"
+                f"Selected format: {format_type.upper()}\n\n"
+                f"🔁 Retrying failed track {i}/{len(failed_entries)}: {entry.title or 'Unknown'}"
+            )
+        
+            try:
+                filename = await download_shared(user_id, message, (entry.key, 'audio'),
+                                                 download_path, download_audio, entry.url)
+            except PermanentError:
+                continue
+            if filename:
+                transcode_tasks.append(asyncio.create_task(transcode_audio(filename, format_type)))
+                track_ids.append(entry.id)
+                failed_entries.remove(entry)
+
+        # Wait for the transcoding stage to finish the remaining tracks
+        if transcode_tasks and any(not task.done() for task in transcode_tasks):
+            await message.edit_text(
+                f"🎛️ Encoding: {playlist_title}\n"
+                f"Selected format: {format_type.upper()}\n\n"
+                f"Finishing {sum(not task.done() for task in transcode_tasks)} remaining tracks..."
+            )
+        results = await asyncio.gather(*transcode_tasks, return_exceptions=True)
+    finally:
+        # Also covers a cancel that lands while a download is being awaited
+        await stop_encoders()
+    downloaded_files = [result for result in results if isinstance(result, str)]
+    downloaded_ids = [video_id for video_id, result in zip(track_ids, results) if isinstance(result, str)]
+
     # Show upload options after download is complete
     if downloaded_files:
         # Create keyboard with upload options including ZIP option
@@ -1352,21 +2062,25 @@ async def download_playlist_audio(url, user_id, format_type, message):
             [InlineKeyboardButton("❌ Cancel", callback_data="cancel_process")]
         ])
         
+        failed_count = len(failed_entries) + unavailable
+        failed_line = f"⚠️ Failed: {failed_count}\n" if failed_count else ""
         await message.edit_text(
             f"✅ Download completed!\n"
             f"Playlist: {playlist_title}\n"
             f"Total audio files: {len(downloaded_files)}\n"
-            f"Format: {format_type.upper()}\n\n"
+            f"Format: {format_type.upper()}\n"
+            f"{failed_line}\n"
             f"Please select where to upload:\n"
             f"ZIP Mode: Off",
             reply_markup=upload_keyboard
         )
         
         # Store download info for later use
-        user_data[user_id]['files'] = downloaded_files
-        user_data[user_id]['playlist_title'] = f"{playlist_title} ({format_type.upper()})"
-        user_data[user_id]['is_audio'] = True
-        user_data[user_id]['zip_mode'] = False
+        job.files = downloaded_files
+        job.entry_ids = downloaded_ids
+        job.title = f"{playlist_title} ({format_type.upper()})"
+        job.zip_mode = False
+        job.save()
         
         return True
     else:
@@ -1382,29 +2096,30 @@ async def handle_quality_selection(client, callback_query: CallbackQuery):
     if data.startswith("quality_"):
         quality = data.split('_')[1]
         
-        if user_id not in user_data:
+        job = user_jobs.get(user_id)
+        if job is None or not job.url:
             await callback_query.answer("Session expired. Please send the URL again.")
             return
         
-        url = user_data[user_id]['url']
-        user_data[user_id]['quality'] = quality
+        if job_running(user_id):
+            await callback_query.answer("A download is already running.")
+            return
         
-        # Make sure user is in active processes
-        if user_id not in active_processes:
-            active_processes[user_id] = {"status_message_id": callback_query.message.id, "cancelled": False}
+        await callback_query.answer()
+        job.quality = quality
+        job.audio_format = None
+        job.save()
+        
+        # Make sure the job has a status message
+        if not job.active:
+            job.start(callback_query.message.id)
         
         await callback_query.message.edit_text(
-            f"Starting download process with {quality}p quality..."
+            f"Starting download process with {quality_label(quality)} quality..."
         )
         
-        # Download the playlist but don't upload yet - let user choose upload method
-        result = await download_playlist(url, user_id, quality, callback_query.message)
-        
-        # If download failed or was cancelled
-        if not result:
-            if not active_processes.get(user_id, {}).get("cancelled", False):
-                await callback_query.message.edit_text("Download failed. Please try again.")
-            active_processes.pop(user_id, None)
+        # Download the playlist in the background but don't upload yet - let user choose upload method
+        dispatch(user_id, 'download', callback_query.message)
 
 @app.on_callback_query(filters.regex(r'^toggle_zip_\d+_(on|off)$'))
 async def toggle_zip_mode(client, callback_query: CallbackQuery):
@@ -1421,13 +2136,15 @@ async def toggle_zip_mode(client, callback_query: CallbackQuery):
         await callback_query.answer("This is not your download.")
         return
     
-    if user_id not in user_data or 'files' not in user_data[user_id]:
+    job = user_jobs.get(user_id)
+    if job is None or not job.files:
         await callback_query.answer("Session expired. Please start over.")
         return
     
     # Toggle the state
     new_state = "off" if current_state == "on" else "on"
-    user_data[user_id]['zip_mode'] = (new_state == "on")
+    job.zip_mode = (new_state == "on")
+    job.save()
     
     # Get the current message text and update it
     message_text = callback_query.message.text
@@ -1435,9 +2152,6 @@ async def toggle_zip_mode(client, callback_query: CallbackQuery):
         message_text = message_text.replace(f"ZIP Mode: {current_state.capitalize()}", f"ZIP Mode: {new_state.capitalize()}")
     
     # Update the keyboard with the new toggle state
-    files = user_data[user_id]['files']
-    playlist_title = user_data[user_id]['playlist_title']
-    
     upload_keyboard = InlineKeyboardMarkup([
         [
             InlineKeyboardButton("📤 Upload to Telegram", callback_data=f"upload_telegram_{user_id}"),
@@ -1472,65 +2186,98 @@ async def handle_upload_selection(client, callback_query: CallbackQuery):
         await callback_query.answer("This is not your download.")
         return
     
-    if user_id not in user_data or 'files' not in user_data[user_id]:
+    job = user_jobs.get(user_id)
+    if job is None or not job.files:
         await callback_query.answer("Session expired. Please start over.")
         return
     
-    files = user_data[user_id]['files']
-    playlist_title = user_data[user_id]['playlist_title']
-    zip_mode = user_data[user_id].get('zip_mode', False)
+    delivered = sync_delivery(job)
     
-    # Make sure user is in active processes
-    if user_id not in active_processes:
-        active_processes[user_id] = {"status_message_id": callback_query.message.id, "cancelled": False}
+    # Make sure the job has a status message
+    if not job.active:
+        job.start(callback_query.message.id)
+    
+    if job_running(user_id):
+        await callback_query.answer("An upload is already running.")
+        return
     
     await callback_query.answer(f"Starting upload to {upload_type.capitalize()}...")
     
+    # Run the upload in the background (on the worker holding the files) so this handler returns immediately
+    dispatch(user_id, 'upload', callback_query.message, pinned=True, upload_type=upload_type, delivered=delivered)
+
+async def run_upload_job(user_id, upload_type, files, playlist_title, zip_mode, message, delivered=None):
+    """Background job: upload the downloaded files, optionally as a single ZIP.
+
+    ``delivered`` is a (sync_id, {file: video_id}) pair, the ids of the
+    files that were uploaded are added to the user's sync archive.
+    """
     # Handle ZIP mode if enabled
     if zip_mode:
-        await callback_query.message.edit_text(
+        await message.edit_text(
             f"Creating ZIP archive for {playlist_title}...\n"
             f"This may take some time depending on the size of the files."
         )
         
+        # The archive is written next to the files it holds, so it needs their size again
+        zip_size = sum(os.path.getsize(file) for file in files if os.path.exists(file))
+        reason = storage.check(user_id, zip_size)
+        if reason:
+            await message.edit_text(
+                f"❌ The ZIP archive needs about {format_size(zip_size)} of disk space, which {reason}.\n"
+                f"Please upload the files individually."
+            )
+            return
+        if not await storage.reserve(user_id, zip_size, wait=False):
+            await message.edit_text(
+                f"⏳ Waiting for {format_size(zip_size)} of disk space to build the ZIP archive...\n"
+                f"The upload will start automatically."
+            )
+            await storage.reserve(user_id, zip_size)
+        
         # Create the ZIP file
         zip_file = await create_zip_file(files, user_id, playlist_title)
         
         if not zip_file:
-            await callback_query.message.edit_text(
+            await storage.release(user_id, zip_size)
+            await message.edit_text(
                 f"❌ Failed to create ZIP archive.\n"
                 f"Please try again or upload files individually."
             )
             return
         
         # Upload the ZIP file based on selected destination
-        if upload_type == 'telegram':
-            await upload_zip_to_telegram(app, user_id, zip_file, playlist_title, 
-                                         callback_query.message, progress)
-        else:  # GoFile
-            await upload_zip_to_gofile(zip_file, callback_query.message, 
-                                       playlist_title, upload_to_gofile)
-        
-        # Clean up the ZIP file after upload
-        try:
-            if os.path.exists(zip_file):
-                os.remove(zip_file)
-        except Exception as e:
-            logger.error(f"Error removing ZIP file: {str(e)}")
+        with bandwidth.transfer(EGRESS, user_id):
+            if upload_type == 'telegram':
+                zip_uploaded = await upload_zip_to_telegram(app, user_id, zip_file, playlist_title, 
+                                                            message, progress)
+            else:  # GoFile
+                zip_uploaded = await upload_zip_to_gofile(app, zip_file, message, 
+                                                          playlist_title, upload_to_gofile)
+        uploaded = files if zip_uploaded else []
+        
+        # Clean up the ZIP file and the zipped downloads after upload
+        await user_jobs.current(user_id).cleanup()
     else:
         # Regular upload without ZIP
-        if upload_type == 'telegram':
-            # Use existing function for Telegram uploads
-            await upload_videos_to_telegram(user_id, files, playlist_title, callback_query.message)
-        else:  # GoFile
-            # Use existing function for GoFile uploads
-            await upload_files_to_gofile(user_id, files, playlist_title, callback_query.message)
+        with bandwidth.transfer(EGRESS, user_id):
+            if upload_type == 'telegram':
+                # Use existing function for Telegram uploads
+                uploaded = await upload_videos_to_telegram(user_id, files, playlist_title, message)
+            else:  # GoFile
+                # Use existing function for GoFile uploads
+                uploaded = await upload_files_to_gofile(user_id, files, playlist_title, message)
+    
+    if delivered:
+        # Failed uploads stay out of the archive so the next sync tries them again
+        sync_id, video_ids = delivered
+        sync_archive.add(user_id, sync_id, [video_ids[file] for file in uploaded if file in video_ids])
 
 # Then modify your existing cancel_upload function to only handle numeric IDs
 @app.on_callback_query(filters.regex(r'^cancel_\d+$'))
 async def cancel_upload(client, callback_query):
     message_id = int(callback_query.data.split('_')[1])
-    upload_cancelled[message_id] = True
+    user_jobs.current(callback_query.from_user.id).cancelled_uploads.add(message_id)
     # Immediately update the message
     await callback_query.message.edit_text("Upload cancelled by user.")
     await callback_query.answer("Upload cancelled successfully")
@@ -1545,18 +2292,12 @@ async def auth_command(client, message):
     try:
         user_id = int(message.command[1])
         
-        # Try to get user info to include username in the response
-        try:
-            user = await app.get_users(user_id)
-            user_mention = f"@{user.username}" if user.username else f"[{user.first_name}](tg://user?id={user_id})"
-        except:
-            user_mention = f"User {user_id}"
+        user_mention = await profiles.mention(app, user_id)
             
-        if user_id in authorized_users:
+        if state.is_authorized(user_id):
             await message.reply_text(f"{user_mention} is already authorized.")
         else:
-            authorized_users.add(user_id)
-            save_authorized_users()
+            state.authorize(user_id)
             await message.reply_text(f"{user_mention} has been authorized.")
     except ValueError:
         await message.reply_text("Invalid user ID. Please provide a valid numeric ID.")
@@ -1572,16 +2313,10 @@ async def revoke_command(client, message):
     try:
         user_id = int(message.command[1])
         
-        # Try to get user info to include username in the response
-        try:
-            user = await app.get_users(user_id)
-            user_mention = f"@{user.username}" if user.username else f"[{user.first_name}](tg://user?id={user_id})"
-        except:
-            user_mention = f"User {user_id}"
+        user_mention = await profiles.mention(app, user_id)
             
-        if user_id in authorized_users:
-            authorized_users.remove(user_id)
-            save_authorized_users()
+        if state.is_authorized(user_id):
+            state.revoke(user_id)
             await message.reply_text(f"Authorization for {user_mention} has been revoked.")
         else:
             await message.reply_text(f"{user_mention} is not in the authorized list.")
@@ -1591,36 +2326,25 @@ async def revoke_command(client, message):
 # Modify the list_auth_command function to mention users
 @app.on_message(filters.command("list") & filters.user(OWNER_ID))
 async def list_auth_command(client, message):
-    if not authorized_users:
+    if not state.authorized:
         await message.reply_text("No users are currently authorized.")
     else:
-        # Get user info for each authorized user
-        auth_list = []
-        for user_id in authorized_users:
-            try:
-                user = await app.get_users(user_id)
-                if user.username:
-                    user_info = f"• {user_id} - @{user.username}"
-                else:
-                    user_info = f"• {user_id} - {user.first_name}"
-            except:
-                user_info = f"• {user_id}"
-            auth_list.append(user_info)
+        # Look up everyone not cached in one go instead of a request per user
+        authorized = await profiles.resolve(app, sorted(state.authorized))
+        auth_list = [
+            f"• {user_id} - {profile.name}" if profile.known else f"• {user_id}"
+            for user_id, profile in authorized.items()
+        ]
         
         await message.reply_text(f"Authorized users:\n{chr(10).join(auth_list)}")
 
-async def send_log(message, disable_notification=False):
-    """Send log message to the configured log channel"""
-    if Config.LOG_CHANNEL != 0:
-        try:
-            await app.send_message(
-                chat_id=Config.LOG_CHANNEL,
-                text=message,
-                disable_notification=disable_notification,
-                link_preview_options=LinkPreviewOptions(is_disabled=True)
-            )
-        except Exception as e:
-            logger.error(f"Failed to send log message: {str(e)}")
+async def deliver_log_digest(text, silent):
+    await app.send_message(
+        chat_id=Config.LOG_CHANNEL,
+        text=text,
+        disable_notification=silent,
+        link_preview_options=LinkPreviewOptions(is_disabled=True)
+    )
 
 @app.on_message(filters.command("setcookies") & filters.user(OWNER_ID))
 async def set_cookies_command(client, message):
@@ -1646,7 +2370,7 @@ async def set_cookies_command(client, message):
 
         # Write cookies to file
         try:
-            with open("cookies.txt", 'w', encoding='utf-8') as f:
+            with open(DEFAULT_COOKIE_FILE, 'w', encoding='utf-8') as f:
                 f.write(cookies_content)
                 
             await message.reply_text(
@@ -1668,10 +2392,242 @@ async def set_cookies_command(client, message):
             quote=True
         )
         
+@app.on_message(filters.command("addcookies") & filters.user(OWNER_ID))
+async def add_cookies_command(client, message):
+    """Add a cookie set to the rotation pool (Owner only)"""
+    if len(message.command) != 2 or not message.reply_to_message or not message.reply_to_message.text:
+        await message.reply_text(
+            "Usage: reply to a message containing cookies with /addcookies [name]",
+            quote=True
+        )
+        return
+
+    cookies_content = message.reply_to_message.text.strip()
+    if not any(domain in cookies_content.lower() for domain in ['.youtube.com', 'youtube.com']):
+        await message.reply_text(
+            "❌ Invalid cookies content. Must contain YouTube cookies.",
+            quote=True
+        )
+        return
+
+    try:
+        path = cookie_pool.add(message.command[1], cookies_content)
+        await message.reply_text(
+            f"✅ Cookie set added to the pool: `{os.path.basename(path)}`\n"
+            f"Pool size: {len(cookie_pool.files())}",
+            quote=True
+        )
+    except Exception as e:
+        logger.error(f"Error in add_cookies_command: {str(e)}")
+        await message.reply_text(f"❌ Error saving cookies: {str(e)}", quote=True)
+
+@app.on_message(filters.command("listcookies") & filters.user(OWNER_ID))
+async def list_cookies_command(client, message):
+    """Show the cookie pool and which sets are quarantined (Owner only)"""
+    files = cookie_pool.files()
+    if not files:
+        await message.reply_text("No cookie files are configured.")
+        return
+
+    lines = []
+    for path in files:
+        remaining = cookie_pool.quarantined_until.get(path, 0) - time.time()
+        status = f"⏸️ quarantined for {format_time(int(remaining))}" if remaining > 0 else "✅ active"
+        lines.append(f"• `{os.path.basename(path)}` - {status} - used {cookie_pool.uses.get(path, 0)} times")
+    await message.reply_text(f"Cookie pool:\n{chr(10).join(lines)}")
+
+@app.on_message(filters.command("delcookies") & filters.user(OWNER_ID))
+async def delete_cookies_command(client, message):
+    """Remove a cookie set from the rotation pool (Owner only)"""
+    if len(message.command) != 2:
+        await message.reply_text("Usage: /delcookies [name]")
+        return
+
+    if cookie_pool.remove(message.command[1]):
+        await message.reply_text(f"✅ Cookie set `{message.command[1]}` removed from the pool.")
+    else:
+        await message.reply_text(f"❌ No cookie set named `{message.command[1]}` in the pool.")
+
+@app.on_message(filters.command("sync"))
+async def sync_command(client, message):
+    """Download only the new videos of a playlist, optionally every few days"""
+    user_id = message.from_user.id
+    
+    if not is_authorized(user_id):
+        await message.reply_text("You are not authorized to use this bot.")
+        return
+    
+    parts = message.text.split()
+    if len(parts) < 2:
+        await message.reply_text(
+            "Usage: /sync <playlist url> [days] [quality or format] [telegram|gofile] [zip]\n\n"
+            "Downloads only the videos you haven't received from this playlist yet. "
+            "Add a number of days to repeat the sync on that schedule. Scheduled syncs "
+            f"download in the given quality ({', '.join(QUALITY_OPTIONS)}) or audio format "
+            f"({', '.join(AUDIO_OPTIONS)}), auto by default, and upload to Telegram "
+            "or GoFile (optionally as one ZIP) without asking."
+        )
+        return
+    
+    url = parts[1]
+    schedule = None
+    if len(parts) > 2:
+        try:
+            interval_days = float(parts[2])
+            if interval_days <= 0:
+                raise ValueError
+        except ValueError:
+            await message.reply_text("The schedule must be a positive number of days.")
+            return
+        option = parts[3].lower().removesuffix('p') if len(parts) > 3 else 'auto'
+        upload_type = parts[4].lower() if len(parts) > 4 else 'telegram'
+        zip_mode = len(parts) > 5 and parts[5].lower() == 'zip'
+        if option not in QUALITY_OPTIONS + AUDIO_OPTIONS or upload_type not in ('telegram', 'gofile'):
+            await message.reply_text(
+                f"Pick a quality ({', '.join(QUALITY_OPTIONS)}) or audio format ({', '.join(AUDIO_OPTIONS)}), "
+                f"and telegram or gofile to upload to."
+            )
+            return
+        # This first run already goes ahead with the saved options
+        schedule = subscriptions.add(
+            user_id, url, interval_days,
+            quality=None if option in AUDIO_OPTIONS else option,
+            audio_format=option if option in AUDIO_OPTIONS else None,
+            upload_type=upload_type, zip_mode=zip_mode
+        )
+        await message.reply_text(
+            f"🔁 This playlist will be synced every {interval_days:g} days and uploaded to {upload_type.capitalize()}."
+        )
+    
+    if has_active_process(user_id):
+        await message.reply_text(
+            "⚠️ You already have an active download process.\n"
+            "Please wait for it to complete or cancel it before starting a new one."
+        )
+        return
+    
+    status_message = await message.reply_text("Checking the playlist for new videos...\n ⌛ Please Wait...")
+    user_jobs.current(user_id).start(status_message.id)
+    user_mention = await profiles.mention(app, user_id)
+    dispatch(user_id, 'probe', status_message, url=url, sync=True, mention=user_mention, schedule=schedule)
+
+@app.on_message(filters.command("unsync"))
+async def unsync_command(client, message):
+    if not is_authorized(message.from_user.id):
+        await message.reply_text("You are not authorized to use this bot.")
+        return
+    
+    parts = message.text.split()
+    if len(parts) < 2:
+        await message.reply_text("Usage: /unsync <playlist url>")
+        return
+    
+    if subscriptions.remove(message.from_user.id, parts[1]):
+        await message.reply_text("✅ Scheduled sync removed.")
+    else:
+        await message.reply_text("❌ You have no scheduled sync for this playlist.")
+
+@app.on_message(filters.command("syncs"))
+async def list_syncs_command(client, message):
+    if not is_authorized(message.from_user.id):
+        await message.reply_text("You are not authorized to use this bot.")
+        return
+    
+    items = subscriptions.for_user(message.from_user.id)
+    if not items:
+        await message.reply_text("You have no scheduled syncs.")
+        return
+    
+    sync_list = "\n".join(
+        f"• {item['url']} (every {item['interval_days']:g} days, next in {format_time(max(0, item['next_run'] - time.time()))})"
+        for item in items
+    )
+    await message.reply_text(f"🔁 Scheduled syncs:\n\n{sync_list}", link_preview_options=LinkPreviewOptions(is_disabled=True))
+
+async def run_scheduled_syncs():
+    """Start playlist syncs as they come due"""
+    while True:
+        await asyncio.sleep(SYNC_CHECK_INTERVAL)
+        for item in subscriptions.due():
+            user_id = item['user_id']
+            if not is_authorized(user_id):
+                subscriptions.remove(user_id, item['url'])
+                continue
+            # Busy users get their sync on a later check
+            if has_active_process(user_id):
+                continue
+            
+            subscriptions.reschedule(item)
+            try:
+                user_mention = await profiles.mention(app, user_id)
+                status_message = await app.send_message(
+                    user_id,
+                    f"🔁 Scheduled sync: {item['url']}\nChecking the playlist for new videos...",
+                    link_preview_options=LinkPreviewOptions(is_disabled=True)
+                )
+            except Exception as e:
+                logger.error(f"Failed to start scheduled sync for user {user_id}: {str(e)}")
+                continue
+            
+            user_jobs.current(user_id).start(status_message.id)
+            # Subscriptions saved before options were stored still ask for them
+            schedule = item if item.get('quality') or item.get('audio_format') else None
+            dispatch(user_id, 'probe', status_message, url=item['url'], sync=True, mention=user_mention, schedule=schedule)
+
+async def run_state_maintenance():
+    """Periodically drop expired sessions and old job records"""
+    while True:
+        await asyncio.sleep(STATE_PURGE_INTERVAL)
+        try:
+            state.purge()
+            await user_jobs.purge()
+            profiles.purge()
+            if job_queue:
+                job_queue.recover()
+                job_queue.purge(Config.JOB_HISTORY_DAYS * 86400)
+        except Exception as e:
+            logger.error(f"Error purging expired state: {str(e)}")
+
+async def main():
+    async with app:
+        sync_task = asyncio.create_task(run_scheduled_syncs())
+        maintenance_task = asyncio.create_task(run_state_maintenance())
+        log_task = asyncio.create_task(log_pipeline.run(deliver_log_digest))
+        metrics_task = asyncio.create_task(metrics.serve(Config.METRICS_HOST, Config.METRICS_PORT)) if Config.METRICS_PORT else None
+        print("Bot is running...")
+        await pyrogram.idle()
+        sync_task.cancel()
+        maintenance_task.cancel()
+        if metrics_task:
+            metrics_task.cancel()
+        # Sends what is still queued while the client is connected
+        log_task.cancel()
+        await asyncio.gather(log_task, return_exceptions=True)
+
 if __name__ == "__main__":
     if not os.path.exists("downloads"):
         os.makedirs("downloads")
-    # Load authorized users when the bot starts
-    load_authorized_users()
-    print("Bot is running...")
-    app.run()
\ No newline at end of file
+    # Open the state store and load authorized users when the bot starts
+    state.open()
+    subscriptions.load()
+    workers = []
+    if job_queue:
+        job_queue.open()
+        # Workers on this machine, more can be started anywhere with worker.py
+        workers = [
+            # Each worker serves its own metrics on the ports after the bot's and
+            # gets an equal part of this machine's disk, link and connection budgets
+            subprocess.Popen(
+                [sys.executable, "worker.py", f"local-{i}"],
+                env={
+                    **os.environ,
+                    "METRICS_PORT": str(Config.METRICS_PORT + i if Config.METRICS_PORT else 0),
+                    "WORKER_SHARE": str(Config.LOCAL_WORKERS),
+                }
+            )
+            for i in range(1, Config.LOCAL_WORKERS + 1)
+        ]
+    app.run(main())
+    for worker in workers:
+        worker.terminate()
+    extractor.shutdown()
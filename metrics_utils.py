@@ -0,0 +1,227 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the duration histogram buckets (seconds)
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# Log record pyrogram writes before sleeping through a FLOOD_WAIT itself
+PYROGRAM_FLOOD_WAIT_LOG = "Waiting for %s seconds before continuing"
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Value that only goes up, one per combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        if not values and not self.labels:
+            values = {(): 0}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+class Histogram:
+    """Distribution of observed values (usually seconds) in fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> [count per bucket, sum, count]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes, also when it raises"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(float(total))}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+class Gauge:
+    """Value read from the rest of the bot when metrics are scraped"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, read):
+        self.name = name
+        self.description = description
+        self.read = read
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.error(f"Failed to read metric {self.name}: {str(e)}")
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+class MetricsRegistry:
+    """Counters, histograms and gauges served in the Prometheus text format.
+
+    Recording is a dict update under a lock, so instrumentation stays on in
+    production. Gauges are only read when the endpoint is scraped.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        # A module imported twice (main.py run as a script) registers again,
+        # every family may only appear once in the exposition
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name, description, read):
+        return self._register(Gauge(name, description, read))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            # Every path gets the metrics, the request itself doesn't matter
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            # Gauges may walk the downloads folder, keep that off the event loop
+            body = (await asyncio.to_thread(self.render)).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Failed to serve metrics: {str(e)}")
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Serve the metrics on host:port until cancelled"""
+        server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+def directory_size(path):
+    """Bytes used by the files under path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # Deleted while walking
+                pass
+    return total
+
+metrics = MetricsRegistry()
+
+extraction_seconds = metrics.histogram(
+    "playlistdl_extraction_seconds", "Time yt-dlp took to extract info for a URL"
+)
+stage_seconds = metrics.histogram(
+    "playlistdl_stage_seconds", "Time spent per file in each pipeline stage", labels=('stage',)
+)
+transferred_bytes = metrics.counter(
+    "playlistdl_transferred_bytes_total", "Bytes downloaded (in) and uploaded (out)", labels=('direction',)
+)
+flood_waits = metrics.counter(
+    "playlistdl_flood_waits_total", "FLOOD_WAIT errors received from Telegram"
+)
+flood_wait_seconds = metrics.counter(
+    "playlistdl_flood_wait_seconds_total", "Seconds slept because of FLOOD_WAIT"
+)
+gofile_errors = metrics.counter(
+    "playlistdl_gofile_errors_total", "Failed GoFile requests", labels=('operation',)
+)
+metrics.gauge(
+    "playlistdl_downloads_disk_bytes", "Bytes used by files in the downloads folder",
+    lambda: directory_size("downloads")
+)
+
+def record_flood_wait(seconds):
+    flood_waits.inc()
+    flood_wait_seconds.inc(seconds)
+
+class FloodWaitLogHandler(logging.Handler):
+    """Counts the FLOOD_WAITs pyrogram sleeps through before retrying a request"""
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and PYROGRAM_FLOOD_WAIT_LOG in record.msg:
+            try:
+                record_flood_wait(float(record.args[1]))
+            except (IndexError, TypeError, ValueError):
+                pass
+
+logging.getLogger("pyrogram.session.session").addHandler(FloodWaitLogHandler(logging.WARNING))
@@ -0,0 +1,105 @@
+import time
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Most users Telegram resolves in one users.getUsers request
+MAX_BATCH_SIZE = 200
+# Failed lookups are retried after this long instead of the full TTL (seconds)
+FAILED_LOOKUP_TTL = 600
+
+class Profile:
+    """The parts of a Telegram user the bot shows in messages and logs"""
+
+    __slots__ = ('user_id', 'username', 'first_name', 'expires_at')
+
+    def __init__(self, user_id, username, first_name, expires_at):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.expires_at = expires_at
+
+    @property
+    def known(self):
+        return bool(self.username or self.first_name)
+
+    @property
+    def mention(self):
+        if self.username:
+            return f"@{self.username}"
+        if self.first_name:
+            return f"[{self.first_name}](tg://user?id={self.user_id})"
+        return f"User {self.user_id}"
+
+    @property
+    def name(self):
+        """Plain name for lists, without a link"""
+        if self.username:
+            return f"@{self.username}"
+        return self.first_name or ""
+
+class ProfileCache:
+    """User profiles kept for a while so mentions don't need a lookup each time.
+
+    Filled from the from_user of incoming messages and callback queries.
+    Users that aren't cached are looked up together in one get_users request
+    (per MAX_BATCH_SIZE users) instead of one request per user.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._profiles = {}
+
+    def remember(self, user):
+        """Cache a pyrogram User"""
+        if user is None:
+            return
+        self._profiles[user.id] = Profile(user.id, user.username, user.first_name, time.time() + self.ttl)
+
+    def _cached(self, user_id):
+        profile = self._profiles.get(user_id)
+        if profile is not None and profile.expires_at < time.time():
+            del self._profiles[user_id]
+            return None
+        return profile
+
+    async def _fetch(self, client, user_ids):
+        try:
+            users = await client.get_users(user_ids)
+        except Exception as e:
+            # One id Telegram can't resolve fails the whole request, so
+            # narrow it down instead of giving up on the rest
+            if len(user_ids) > 1:
+                middle = len(user_ids) // 2
+                await self._fetch(client, user_ids[:middle])
+                await self._fetch(client, user_ids[middle:])
+                return
+            logger.warning(f"Failed to look up user {user_ids[0]}: {str(e)}")
+            self._profiles[user_ids[0]] = Profile(user_ids[0], None, None, time.time() + FAILED_LOOKUP_TTL)
+            return
+        for user in users:
+            self.remember(user)
+
+    async def resolve(self, client, user_ids):
+        """Profiles of several users, missing ones fetched in batches"""
+        user_ids = list(dict.fromkeys(user_ids))
+        missing = [user_id for user_id in user_ids if self._cached(user_id) is None]
+        for start in range(0, len(missing), MAX_BATCH_SIZE):
+            await self._fetch(client, missing[start:start + MAX_BATCH_SIZE])
+        return {
+            user_id: self._cached(user_id) or Profile(user_id, None, None, 0)
+            for user_id in user_ids
+        }
+
+    async def mention(self, client, user_id):
+        """Markdown mention of a user, "User <id>" if they can't be looked up"""
+        profiles = await self.resolve(client, [user_id])
+        return profiles[user_id].mention
+
+    def purge(self):
+        now = time.time()
+        for user_id in [user_id for user_id, profile in self._profiles.items() if profile.expires_at < now]:
+            del self._profiles[user_id]
+
+profiles = ProfileCache(Config.PROFILE_TTL_HOURS * 3600)
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class Endpoint:
+    """One outbound route: a proxy URL, a local source address, or a direct connection"""
+
+    def __init__(self, spec, limit):
+        self.spec = spec
+        self.limit = limit
+        self.active = 0
+        self.failures = 0
+        self.down_until = 0
+
+    @property
+    def is_healthy(self):
+        return self.down_until <= time.time()
+
+    def ydl_opts(self):
+        """yt-dlp options that route traffic through this endpoint"""
+        if self.spec == 'direct':
+            return {}
+        if self.spec.startswith('source:'):
+            return {'source_address': self.spec[len('source:'):]}
+        return {'proxy': self.spec}
+
+class ProxyPool:
+    """Spreads download workers across outbound proxies and source addresses.
+
+    Each worker gets the healthy endpoint with the fewest active transfers,
+    bounded by a per-endpoint concurrency limit. Endpoints that keep failing
+    or get throttled are taken out of rotation for a cooldown.
+    """
+
+    def __init__(self, specs, limit, failure_threshold, cooldown):
+        self.endpoints = [Endpoint(spec, limit) for spec in specs]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.condition = asyncio.Condition()
+
+    def _pick(self):
+        healthy = [e for e in self.endpoints if e.is_healthy] or self.endpoints
+        free = [e for e in healthy if not e.limit or e.active < e.limit]
+        if not free:
+            return None
+        return min(free, key=lambda e: (e.active, e.failures))
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Hold an endpoint for one transfer, yields None if no pool is configured"""
+        if not self.endpoints:
+            yield None
+            return
+
+        async with self.condition:
+            endpoint = self._pick()
+            while endpoint is None:
+                await self.condition.wait()
+                endpoint = self._pick()
+            endpoint.active += 1
+
+        try:
+            yield endpoint
+        finally:
+            async with self.condition:
+                endpoint.active -= 1
+                self.condition.notify_all()
+
+    def report_success(self, endpoint):
+        if endpoint:
+            endpoint.failures = 0
+
+    def report_failure(self, endpoint, throttled=False):
+        """Record a failed transfer, a throttled endpoint is benched straight away"""
+        if not endpoint:
+            return
+        endpoint.failures += 1
+        if throttled or endpoint.failures >= self.failure_threshold:
+            endpoint.failures = 0
+            endpoint.down_until = time.time() + self.cooldown
+            logger.warning(f"Endpoint {endpoint.spec} taken out of rotation for {self.cooldown}s")
+
+proxy_pool = ProxyPool(
+    [spec.strip() for spec in Config.PROXIES.split(',') if spec.strip()],
+    limit=Config.PROXY_CONCURRENCY,
+    failure_threshold=Config.PROXY_FAILURE_THRESHOLD,
+    cooldown=Config.PROXY_COOLDOWN,
+)
@@ -0,0 +1,204 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from config import Config
+from scheduler_utils import USER_LANE
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    affinity TEXT,
+    lane INTEGER NOT NULL DEFAULT 2,
+    cost REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS queue_status ON queue (status, id);
+CREATE INDEX IF NOT EXISTS queue_user_id ON queue (user_id, status);
+"""
+
+# A claimed item runs on this many workers at most before it is given up
+MAX_ATTEMPTS = 2
+# Columns added after the first version of the queue table
+ADDED_COLUMNS = {
+    'lane': "INTEGER NOT NULL DEFAULT 2",
+    'cost': "REAL NOT NULL DEFAULT 0",
+}
+
+class QueueItem:
+    """A job claimed from the queue"""
+
+    __slots__ = ('id', 'user_id', 'kind', 'payload')
+
+    def __init__(self, item_id, user_id, kind, payload):
+        self.id = item_id
+        self.user_id = user_id
+        self.kind = kind
+        self.payload = payload
+
+class JobQueue:
+    """Durable job queue between the bot and its download/upload workers.
+
+    Backed by a SQLite (WAL) file, so the bot and any number of worker
+    processes on the same machine can share it. Workers claim items one at a
+    time and heartbeat them while they run. Items whose worker stopped
+    heartbeating are put back in the queue. Items can be pinned to the worker
+    that holds the user's downloaded files.
+
+    Workers claim the way the in-process JobScheduler hands out slots: by
+    priority lane, then by estimated cost, which halves every
+    aging_half_life seconds an item waits.
+    """
+
+    def __init__(self, path, lease, aging_half_life=0):
+        self.path = path
+        self.lease = lease
+        self.aging_half_life = aging_half_life
+        self._db = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(queue)")}
+        for column, definition in ADDED_COLUMNS.items():
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE queue ADD COLUMN {column} {definition}")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _update(self, sql, params=()):
+        """Run a write, returns the number of rows it changed or the new row's id"""
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            return cursor.lastrowid if sql.startswith("INSERT") else cursor.rowcount
+
+    def put(self, user_id, kind, payload, pinned=False, lane=USER_LANE, cost=0):
+        """Queue a job, pinned jobs only run on the worker that ran the user's last job"""
+        affinity = self.last_worker(user_id) if pinned else None
+        item_id = self._update(
+            "INSERT INTO queue (user_id, kind, payload, affinity, lane, cost, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, kind, json.dumps(payload), affinity, lane, cost, time.time())
+        )
+        logger.info(f"Queued {kind} job {item_id} for user {user_id}" + (f" on {affinity}" if affinity else ""))
+        return item_id
+
+    def last_worker(self, user_id):
+        rows = self._execute(
+            "SELECT worker FROM queue WHERE user_id = ? AND worker IS NOT NULL ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        )
+        return rows[0][0] if rows else None
+
+    def _key(self, row, now):
+        _, _, _, _, lane, cost, created_at = row
+        if self.aging_half_life:
+            cost *= 0.5 ** ((now - created_at) / self.aging_half_life)
+        return (lane, cost, created_at)
+
+    def claim(self, worker_id):
+        """Take the job this worker should run next, or None"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, user_id, kind, payload, lane, cost, created_at FROM queue "
+                    "WHERE status = 'queued' AND (affinity IS NULL OR affinity = ?)",
+                    (worker_id,)
+                ).fetchall()
+                now = time.time()
+                row = min(rows, key=lambda row: self._key(row, now)) if rows else None
+                if row:
+                    self._db.execute(
+                        "UPDATE queue SET status = 'claimed', worker = ?, attempts = attempts + 1, heartbeat_at = ? WHERE id = ?",
+                        (worker_id, time.time(), row[0])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return QueueItem(row[0], row[1], row[2], json.loads(row[3]))
+
+    def heartbeat(self, item_ids):
+        now = time.time()
+        for item_id in item_ids:
+            self._update("UPDATE queue SET heartbeat_at = ? WHERE id = ?", (now, item_id))
+
+    def finish(self, item_id, status):
+        self._update("UPDATE queue SET status = ? WHERE id = ?", (status, item_id))
+
+    def cancel_requested(self, item_id):
+        rows = self._execute("SELECT cancel_requested FROM queue WHERE id = ?", (item_id,))
+        return bool(rows and rows[0][0])
+
+    def cancel(self, user_id):
+        """Drop the user's queued jobs and ask workers to stop running ones.
+
+        Returns whether the user had any job queued or running.
+        """
+        queued = self._update(
+            "UPDATE queue SET status = 'cancelled' WHERE user_id = ? AND status = 'queued'",
+            (user_id,)
+        )
+        running = self._update(
+            "UPDATE queue SET cancel_requested = 1 WHERE user_id = ? AND status = 'claimed'",
+            (user_id,)
+        )
+        return bool(queued or running)
+
+    def has_pending(self, user_id):
+        """Whether the user has a job waiting for or running on a worker"""
+        rows = self._execute(
+            "SELECT 1 FROM queue WHERE user_id = ? AND status IN ('queued', 'claimed') AND kind != 'cleanup' LIMIT 1",
+            (user_id,)
+        )
+        return bool(rows)
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._execute("SELECT COUNT(*) FROM queue WHERE status = 'queued'")[0][0]
+
+    def recover(self):
+        """Requeue jobs whose worker stopped heartbeating, give up on ones that keep failing"""
+        stale = time.time() - self.lease
+        self._update(
+            "UPDATE queue SET status = 'cancelled' WHERE status = 'claimed' AND heartbeat_at < ? AND cancel_requested = 1",
+            (stale,)
+        )
+        failed = self._update(
+            "UPDATE queue SET status = 'failed' WHERE status = 'claimed' AND heartbeat_at < ? AND attempts >= ?",
+            (stale, MAX_ATTEMPTS)
+        )
+        # The stopped worker's files can't be relied on, so the job may run anywhere
+        requeued = self._update(
+            "UPDATE queue SET status = 'queued', affinity = NULL WHERE status = 'claimed' AND heartbeat_at < ?",
+            (stale,)
+        )
+        if failed or requeued:
+            logger.warning(f"Recovered queue items from stopped workers: {requeued} requeued, {failed} failed")
+
+    def purge(self, max_age):
+        """Remove finished items older than max_age seconds"""
+        self._update(
+            "DELETE FROM queue WHERE status NOT IN ('queued', 'claimed') AND created_at < ?",
+            (time.time() - max_age,)
+        )
+
+job_queue = JobQueue(Config.JOB_QUEUE_DB, Config.QUEUE_LEASE, Config.JOB_AGING_MINUTES * 60) if Config.JOB_QUEUE_DB else None
@@ -0,0 +1,79 @@
+import time
+import asyncio
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower runs first
+OWNER_LANE = 0
+ADMIN_LANE = 1
+USER_LANE = 2
+
+def job_lane(user_id):
+    """Priority lane of a user's jobs"""
+    if user_id == Config.OWNER_ID:
+        return OWNER_LANE
+    if user_id in Config.ADMIN_IDS:
+        return ADMIN_LANE
+    return USER_LANE
+
+class JobScheduler:
+    """Hands a limited number of download slots to waiting jobs, cheapest first.
+
+    Jobs wait in their priority lane (owner, admins, everyone else) ordered by
+    estimated cost, so a few tracks don't queue behind a 500-video playlist.
+    A waiting job's cost halves every aging_half_life seconds, which lets
+    large jobs overtake newer small ones eventually instead of starving.
+    """
+
+    def __init__(self, slots, aging_half_life):
+        self.slots = slots
+        self.aging_half_life = aging_half_life
+        self.running = set()
+        self.waiting = {}
+        self.condition = asyncio.Condition()
+
+    def _key(self, job_id, now):
+        lane, cost, since = self.waiting[job_id]
+        if self.aging_half_life:
+            cost *= 0.5 ** ((now - since) / self.aging_half_life)
+        return (lane, cost, since)
+
+    def _queue(self):
+        now = time.time()
+        return sorted(self.waiting, key=lambda job_id: self._key(job_id, now))
+
+    def _can_run(self, job_id):
+        if self.slots and len(self.running) >= self.slots:
+            return False
+        return self._queue()[0] == job_id
+
+    def has_free_slot(self):
+        """Whether a job arriving now would start without waiting"""
+        return not self.waiting and (not self.slots or len(self.running) < self.slots)
+
+    async def acquire(self, job_id, cost, lane=USER_LANE):
+        """Wait until it is this job's turn to run"""
+        async with self.condition:
+            self.waiting[job_id] = (lane, cost, time.time())
+            try:
+                while not self._can_run(job_id):
+                    await self.condition.wait()
+            finally:
+                self.waiting.pop(job_id, None)
+                # Let the next job check whether it's up now
+                self.condition.notify_all()
+            self.running.add(job_id)
+            logger.info(f"Job for user {job_id} started (lane {lane}, cost {cost}, {len(self.running)} running)")
+
+    async def release(self, job_id):
+        """Give a job's slot to the next one in line"""
+        async with self.condition:
+            self.running.discard(job_id)
+            self.condition.notify_all()
+
+scheduler = JobScheduler(
+    Config.PROCESS_CONCURRENT_JOBS,
+    Config.JOB_AGING_MINUTES * 60
+)
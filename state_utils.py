@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    authorized_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_user_id ON jobs (user_id);
+CREATE INDEX IF NOT EXISTS jobs_started_at ON jobs (started_at);
+"""
+
+# The flat file authorized users were kept in before the state store
+LEGACY_AUTH_FILE = "authorized_users.txt"
+
+class StateStore:
+    """SQLite (WAL) store for authorized users, sessions and job records.
+
+    Authorized users are cached in memory so is_authorized stays a set
+    lookup, sessions are read through an in-memory cache and written through
+    to disk. Expired sessions and old job records are removed by purge().
+    A shared store is also written by worker processes, so its sessions are
+    always read from disk.
+    """
+
+    def __init__(self, path, session_ttl, job_history, shared=False):
+        self.path = path
+        self.session_ttl = session_ttl
+        self.job_history = job_history
+        self.shared = shared
+        self.authorized = set()
+        self._sessions = {}
+        self._db = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Open the database and load the authorized users"""
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        # Jobs can't survive a restart, unless other processes run them
+        if not self.shared:
+            self._execute("UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE finished_at IS NULL", (time.time(),))
+
+        self.authorized = {row[0] for row in self._execute("SELECT user_id FROM users")}
+        if not self.authorized and os.path.exists(LEGACY_AUTH_FILE):
+            self._import_legacy_users()
+        logger.info(f"Loaded {len(self.authorized)} authorized users")
+
+    def _import_legacy_users(self):
+        with open(LEGACY_AUTH_FILE, "r") as f:
+            user_ids = [int(line.strip()) for line in f if line.strip().isdigit()]
+        for user_id in user_ids:
+            self.authorize(user_id)
+        logger.info(f"Imported {len(user_ids)} authorized users from {LEGACY_AUTH_FILE}")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # Users
+
+    def is_authorized(self, user_id):
+        return user_id in self.authorized
+
+    def authorize(self, user_id):
+        self._execute("INSERT OR IGNORE INTO users (user_id, authorized_at) VALUES (?, ?)", (user_id, time.time()))
+        self.authorized.add(user_id)
+
+    def revoke(self, user_id):
+        self._execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        self.authorized.discard(user_id)
+
+    # Sessions
+
+    def get(self, user_id, default=None):
+        """The user's session data, or default if there is none or it expired"""
+        cached = None if self.shared else self._sessions.get(user_id)
+        if cached is None:
+            rows = self._execute("SELECT data, expires_at FROM sessions WHERE user_id = ?", (user_id,))
+            if not rows:
+                return default
+            cached = (json.loads(rows[0][0]), rows[0][1])
+            self._sessions[user_id] = cached
+        data, expires_at = cached
+        if expires_at <= time.time():
+            self.drop(user_id)
+            return default
+        return data
+
+    def set(self, user_id, data):
+        """Replace the user's session, which then lives for another session_ttl"""
+        expires_at = time.time() + self.session_ttl
+        self._sessions[user_id] = (data, expires_at)
+        self._execute(
+            "INSERT OR REPLACE INTO sessions (user_id, data, expires_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(data), expires_at)
+        )
+
+    def update(self, user_id, **fields):
+        """Change some fields of the user's session"""
+        self.set(user_id, {**self.get(user_id, {}), **fields})
+
+    def drop(self, user_id):
+        self._sessions.pop(user_id, None)
+        self._execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    # Job records
+
+    def job_started(self, user_id, name):
+        """Record a job start, returns the record id"""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (user_id, name, status, started_at) VALUES (?, ?, 'running', ?)",
+                (user_id, name, time.time())
+            )
+            return cursor.lastrowid
+
+    def job_finished(self, record_id, status, error=None):
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, time.time(), record_id)
+        )
+
+    def purge(self):
+        """Remove expired sessions and job records older than job_history"""
+        now = time.time()
+        for user_id, (_, expires_at) in list(self._sessions.items()):
+            if expires_at <= now:
+                self._sessions.pop(user_id, None)
+        self._execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        if self.job_history:
+            self._execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.job_history,))
+
+state = StateStore(
+    Config.STATE_DB,
+    session_ttl=Config.SESSION_TTL_HOURS * 3600,
+    job_history=Config.JOB_HISTORY_DAYS * 86400,
+    shared=bool(Config.JOB_QUEUE_DB),
+)
@@ -0,0 +1,89 @@
+import os
+import shutil
+import asyncio
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 * 1024 * 1024
+
+class StorageManager:
+    """Reserves scratch space for jobs against a global budget and per-user quotas.
+
+    A job reserves its estimated footprint before it starts writing into
+    downloads/, and gives the space back as its files are delivered. Jobs that
+    could never fit are rejected up front, the rest wait until space is freed.
+    """
+
+    def __init__(self, root, budget=0, user_quota=0, headroom=0, share=1):
+        self.root = root
+        self.user_quota = user_quota
+        self.headroom = headroom
+        # Processes using the same disk, each gets an equal part of its free space
+        self.share = share
+        self._budget = budget
+        self.reserved = {}
+        self.condition = asyncio.Condition()
+
+    @property
+    def budget(self):
+        """Total bytes jobs may reserve (free disk space at first use if not configured)"""
+        if not self._budget:
+            os.makedirs(self.root, exist_ok=True)
+            usage = shutil.disk_usage(self.root)
+            self._budget = max(0, usage.free - self.headroom) // self.share
+            logger.info(f"Scratch budget set to {self._budget} bytes from free disk space")
+        return self._budget
+
+    @property
+    def total_reserved(self):
+        return sum(self.reserved.values())
+
+    def check(self, user_id, nbytes):
+        """Return a reason string if nbytes more can never be reserved for the user.
+
+        What the user already holds only comes back when their job is done,
+        so it counts against the limits too.
+        """
+        nbytes += self.reserved.get(user_id, 0)
+        if self.user_quota and nbytes > self.user_quota:
+            return f"exceeds your storage quota of {self.user_quota / GB:.1f} GB"
+        if nbytes > self.budget:
+            return f"exceeds the available scratch space of {self.budget / GB:.1f} GB"
+        return None
+
+    def _fits(self, user_id, nbytes):
+        if self.user_quota and self.reserved.get(user_id, 0) + nbytes > self.user_quota:
+            return False
+        return self.total_reserved + nbytes <= self.budget
+
+    async def reserve(self, user_id, nbytes, wait=True):
+        """Reserve space for a job, waiting for other jobs to release it if needed"""
+        async with self.condition:
+            while not self._fits(user_id, nbytes):
+                if not wait:
+                    return False
+                await self.condition.wait()
+            self.reserved[user_id] = self.reserved.get(user_id, 0) + nbytes
+            logger.info(f"Reserved {nbytes} bytes for user {user_id} ({self.total_reserved} bytes reserved in total)")
+            return True
+
+    async def release(self, user_id, nbytes=None):
+        """Give back part of a user's reservation, or all of it if nbytes is None"""
+        async with self.condition:
+            held = self.reserved.get(user_id, 0)
+            remaining = 0 if nbytes is None else max(0, held - nbytes)
+            if remaining:
+                self.reserved[user_id] = remaining
+            else:
+                self.reserved.pop(user_id, None)
+            self.condition.notify_all()
+
+storage = StorageManager(
+    "downloads",
+    budget=int(Config.PROCESS_SCRATCH_BUDGET_GB * GB),
+    user_quota=int(Config.USER_QUOTA_GB * GB),
+    headroom=int(Config.DISK_HEADROOM_GB * GB),
+    share=Config.WORKER_SHARE,
+)
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYNC_DIR = "sync"
+SUBSCRIPTIONS_FILE = os.path.join(SYNC_DIR, "subscriptions.json")
+
+def _safe_name(name):
+    return "".join(c if c.isalnum() or c in '-_' else '_' for c in str(name))
+
+class SyncArchive:
+    """Per-user, per-playlist record of the video ids already delivered.
+
+    Stored as one id per line in sync/<user_id>/<playlist_id>.txt, so a sync
+    run only has to download what was added to the playlist since.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, user_id, playlist_id):
+        return os.path.join(self.directory, str(user_id), f"{_safe_name(playlist_id)}.txt")
+
+    def load(self, user_id, playlist_id):
+        """Set of video ids delivered to the user from this playlist"""
+        path = self._path(user_id, playlist_id)
+        if not os.path.exists(path):
+            return set()
+        with open(path, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def new_entries(self, user_id, playlist_id, entries):
+        """Entries of the playlist that haven't been delivered to the user yet"""
+        delivered = self.load(user_id, playlist_id)
+        return [entry for entry in entries if entry and entry.get('id') not in delivered]
+
+    def add(self, user_id, playlist_id, video_ids):
+        """Record video ids as delivered"""
+        path = self._path(user_id, playlist_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for video_id in video_ids:
+                f.write(f"{video_id}\n")
+        logger.info(f"Archived {len(video_ids)} delivered videos of {playlist_id} for user {user_id}")
+
+class Subscriptions:
+    """Playlists users want synced on a schedule, saved as JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.items = []
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.items = json.load(f)
+        logger.info(f"Loaded {len(self.items)} playlist subscriptions")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.items, f, indent=2)
+
+    def for_user(self, user_id):
+        return [item for item in self.items if item['user_id'] == user_id]
+
+    def add(self, user_id, url, interval_days, quality=None, audio_format=None, upload_type='telegram', zip_mode=False):
+        """Subscribe the user to a playlist, replacing an existing subscription to it.
+
+        Scheduled runs download in the given quality or audio format and
+        upload to upload_type without asking. Returns the subscription.
+        """
+        self.remove(user_id, url)
+        item = {
+            'user_id': user_id,
+            'url': url,
+            'interval_days': interval_days,
+            'next_run': time.time() + interval_days * 86400,
+            'quality': quality,
+            'audio_format': audio_format,
+            'upload_type': upload_type,
+            'zip_mode': zip_mode,
+        }
+        self.items.append(item)
+        self.save()
+        return item
+
+    def remove(self, user_id, url):
+        """Drop a subscription, returns False if the user had none for url"""
+        remaining = [item for item in self.items if not (item['user_id'] == user_id and item['url'] == url)]
+        removed = len(remaining) != len(self.items)
+        self.items = remaining
+        if removed:
+            self.save()
+        return removed
+
+    def due(self):
+        """Subscriptions whose next sync time has passed"""
+        now = time.time()
+        return [item for item in self.items if item['next_run'] <= now]
+
+    def reschedule(self, item):
+        item['next_run'] = time.time() + item['interval_days'] * 86400
+        self.save()
+
+sync_archive = SyncArchive(SYNC_DIR)
+subscriptions = Subscriptions(SUBSCRIPTIONS_FILE)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules read their settings from the environment when imported
+for key, value in {'OWNER_ID': '1', 'UPLOAD_INTERVAL': '1', 'LOG_CHANNEL': '0'}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,157 @@
+"""ProxyPool rotation and health tracking, run against local stand-in proxies"""
+import time
+import socket
+import asyncio
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from proxy_utils import ProxyPool
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """Forwards plain HTTP requests and counts the ones it carried"""
+
+    def do_GET(self):
+        self.server.requests += 1
+        with urllib.request.urlopen(self.path, timeout=5) as response:
+            body = response.read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TargetHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def dead_proxy_url():
+    """URL of a local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def target():
+    server = serve(TargetHandler)
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+
+@pytest.fixture
+def proxies():
+    servers = [serve(ProxyHandler), serve(ProxyHandler)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+
+
+def fetch(endpoint, url):
+    """Request url through the proxy the endpoint hands to yt-dlp"""
+    proxy = endpoint.ydl_opts()['proxy']
+    return requests.get(url, proxies={'http': proxy}, timeout=5)
+
+
+def test_concurrent_transfers_rotate_across_proxies(proxies, target):
+    pool = ProxyPool([f"http://127.0.0.1:{server.server_port}" for server in proxies],
+                     limit=2, failure_threshold=3, cooldown=60)
+
+    async def run():
+        async def transfer():
+            async with pool.acquire() as endpoint:
+                response = await asyncio.to_thread(fetch, endpoint, target)
+                assert response.text == 'ok'
+                pool.report_success(endpoint)
+        await asyncio.gather(*(transfer() for _ in range(4)))
+
+    asyncio.run(run())
+    assert [server.requests for server in proxies] == [2, 2]
+
+
+def test_per_endpoint_limit_makes_extra_transfers_wait(proxies):
+    pool = ProxyPool([f"http://127.0.0.1:{proxies[0].server_port}"], limit=1, failure_threshold=3, cooldown=60)
+
+    async def run():
+        order = []
+
+        async def transfer(name, hold):
+            async with pool.acquire() as endpoint:
+                order.append(name)
+                assert endpoint.active <= endpoint.limit
+                await asyncio.sleep(hold)
+
+        first = asyncio.create_task(transfer('first', 0.2))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(transfer('second', 0))
+        await asyncio.sleep(0.05)
+        assert order == ['first']
+        await asyncio.gather(first, second)
+        return order
+
+    assert asyncio.run(run()) == ['first', 'second']
+
+
+def test_failing_proxy_is_benched_and_recovers_after_cooldown(proxies, target):
+    dead = dead_proxy_url()
+    pool = ProxyPool([dead, f"http://127.0.0.1:{proxies[0].server_port}"],
+                     limit=0, failure_threshold=2, cooldown=0.5)
+    dead_endpoint = pool.endpoints[0]
+
+    async def run():
+        # Fail the dead proxy until the threshold benches it
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.ProxyError):
+                await asyncio.to_thread(fetch, dead_endpoint, target)
+            pool.report_failure(dead_endpoint)
+        assert not dead_endpoint.is_healthy
+
+        # Benched: every transfer goes through the healthy proxy
+        for _ in range(3):
+            async with pool.acquire() as endpoint:
+                assert endpoint is not dead_endpoint
+                assert (await asyncio.to_thread(fetch, endpoint, target)).text == 'ok'
+
+        time.sleep(0.6)
+        assert dead_endpoint.is_healthy
+        async with pool.acquire() as endpoint:
+            assert endpoint is dead_endpoint
+
+    asyncio.run(run())
+    assert proxies[0].requests == 3
+
+
+def test_throttled_proxy_is_benched_straight_away(proxies):
+    pool = ProxyPool([f"http://127.0.0.1:{server.server_port}" for server in proxies],
+                     limit=0, failure_threshold=3, cooldown=60)
+    throttled = pool.endpoints[0]
+    pool.report_failure(throttled, throttled=True)
+
+    async def run():
+        for _ in range(3):
+            async with pool.acquire() as endpoint:
+                assert endpoint is pool.endpoints[1]
+
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+import time
+import asyncio
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Error fragments YouTube returns when it starts rate limiting us
+THROTTLE_MARKERS = (
+    'http error 429',
+    'too many requests',
+    "sign in to confirm you're not a bot",
+    'sign in to confirm you’re not a bot',
+    'rate-limited',
+    'rate limited',
+    'try again later',
+)
+
+# Errors that will not go away by retrying
+PERMANENT_MARKERS = (
+    'private video',
+    'video unavailable',
+    'has been removed',
+    'copyright',
+    'members-only',
+    'this live event will begin',
+)
+
+class PermanentError(Exception):
+    """An entry that retrying will not bring back (private, removed, ...)"""
+
+def is_throttle_error(error):
+    text = str(error).lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+def is_permanent_error(error):
+    text = str(error).lower()
+    return any(marker in text for marker in PERMANENT_MARKERS)
+
+class CircuitBreaker:
+    """Pauses extraction across all jobs once YouTube starts throttling.
+
+    After ``threshold`` throttling errors in a row (from any job) the breaker
+    opens for ``cooldown`` seconds, and every download waits it out instead
+    of hammering YouTube with the rest of its playlist.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+
+    @property
+    def remaining(self):
+        """Seconds left before extraction may resume"""
+        return max(0, self.open_until - time.time())
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_throttle(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.failures = 0
+            self.open_until = time.time() + self.cooldown
+            logger.warning(f"YouTube is throttling us, pausing extraction for {self.cooldown}s")
+
+    async def wait(self):
+        """Sleep until the breaker is closed again"""
+        while self.remaining > 0:
+            await asyncio.sleep(self.remaining)
+
+breaker = CircuitBreaker(Config.THROTTLE_THRESHOLD, Config.THROTTLE_COOLDOWN)
@@ -0,0 +1,43 @@
+import logging
+from config import Config
+from metrics_utils import stage_seconds, transferred_bytes
+
+logger = logging.getLogger(__name__)
+
+class ThroughputMeter:
+    """Tracks the recent transfer speed as an exponentially weighted average.
+
+    Every transfer is also counted in the metrics under the meter's stage
+    and direction.
+    """
+
+    def __init__(self, default_bps, stage, direction, alpha=0.3):
+        self.default_bps = default_bps
+        self.stage = stage
+        self.direction = direction
+        self.alpha = alpha
+        self.rate = None
+
+    def record(self, nbytes, seconds):
+        """Fold a finished transfer into the average"""
+        transferred_bytes.inc(max(0, nbytes), direction=self.direction)
+        stage_seconds.observe(max(0, seconds), stage=self.stage)
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = self.alpha * rate + (1 - self.alpha) * self.rate
+
+    @property
+    def bytes_per_second(self):
+        return self.rate or self.default_bps
+
+    def estimate(self, nbytes):
+        """Seconds needed to move nbytes at the recent speed"""
+        return nbytes / self.bytes_per_second
+
+# Mbps from the config are only used until real transfers have been measured
+download_meter = ThroughputMeter(Config.DEFAULT_DOWNLOAD_MBPS * 1000 * 1000 / 8, 'download', 'in')
+upload_meter = ThroughputMeter(Config.DEFAULT_UPLOAD_MBPS * 1000 * 1000 / 8, 'upload', 'out')
@@ -0,0 +1,107 @@
+"""Worker process: runs the download and upload jobs the bot queues.
+
+Run ``python worker.py <worker id>`` on a machine sharing the bot's
+JOB_QUEUE_DB and state store (the bot starts LOCAL_WORKERS of these itself).
+Each worker logs in with its own Telegram session that doesn't receive
+updates, and uses it to edit the job's status message and upload the files.
+"""
+import os
+import sys
+
+if __name__ == "__main__":
+    # Must be set before the config is loaded
+    os.environ["WORKER_ID"] = sys.argv[1] if len(sys.argv) > 1 else f"worker-{os.getpid()}"
+
+import time
+import asyncio
+import logging
+from config import Config
+from main import app, build_job, job_error_reporter, deliver_log_digest
+from job_utils import jobs, user_jobs
+from state_utils import state
+from queue_utils import job_queue
+from extractor_utils import extractor
+from log_utils import log_pipeline
+from metrics_utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often the queue is checked for new jobs and cancel requests (seconds)
+POLL_INTERVAL = 1
+# How often running jobs are marked alive in the queue (seconds)
+HEARTBEAT_INTERVAL = 10
+
+async def start_item(item):
+    """Start a claimed job, returns its task or None if it couldn't start"""
+    try:
+        message = await app.get_messages(item.payload['chat_id'], item.payload['message_id'])
+        coro, name = build_job(item.kind, item.user_id, message, item.payload)
+    except Exception as e:
+        logger.error(f"Failed to start queued {item.kind} job {item.id}: {str(e)}")
+        job_queue.finish(item.id, 'failed')
+        return None
+
+    logger.info(f"Worker {Config.WORKER_ID} running {name} for user {item.user_id}")
+    if item.kind == 'cleanup':
+        # Runs next to the cancelled job instead of replacing it as the user's job
+        return asyncio.create_task(coro)
+    return jobs.start(item.user_id, coro, name, on_error=job_error_reporter(item.user_id, message))
+
+async def work():
+    """Claim and run queued jobs until the worker is stopped"""
+    running = {}
+    cancelled = set()
+    last_heartbeat = 0
+    while True:
+        for item_id, (item, task) in list(running.items()):
+            if task.done():
+                job_queue.finish(item_id, 'cancelled' if task.cancelled() else 'done')
+                del running[item_id]
+                cancelled.discard(item_id)
+            elif item_id not in cancelled and job_queue.cancel_requested(item_id):
+                cancelled.add(item_id)
+                jobs.cancel(item.user_id)
+
+        if time.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+            job_queue.heartbeat(list(running))
+            # Hand jobs of workers that stopped to the ones still running
+            job_queue.recover()
+            # Files of expired sessions downloaded here are never uploaded
+            await user_jobs.purge()
+            last_heartbeat = time.time()
+
+        item = job_queue.claim(Config.WORKER_ID) if len(running) < Config.WORKER_CONCURRENCY else None
+        if item is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        task = await start_item(item)
+        if task is not None:
+            running[item.id] = (item, task)
+
+async def main():
+    async with app:
+        logger.info(f"Worker {Config.WORKER_ID} is running")
+        log_task = asyncio.create_task(log_pipeline.run(deliver_log_digest))
+        metrics_task = asyncio.create_task(metrics.serve(Config.METRICS_HOST, Config.METRICS_PORT)) if Config.METRICS_PORT else None
+        try:
+            await work()
+        finally:
+            if metrics_task:
+                metrics_task.cancel()
+            await jobs.shutdown()
+            log_task.cancel()
+            await asyncio.gather(log_task, return_exceptions=True)
+
+if __name__ == "__main__":
+    if not Config.JOB_QUEUE_DB:
+        sys.exit("JOB_QUEUE_DB is not set, the bot runs its jobs itself")
+    if not os.path.exists("downloads"):
+        os.makedirs("downloads")
+    state.open()
+    job_queue.open()
+    try:
+        app.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        extractor.shutdown()
@@ -1,13 +1,109 @@
-  GNU nano 7.2                                                                zip_utils.py *                                                                       
 import os
+import zlib
 import zipfile
-import shutil
 import logging
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config import Config
+from throughput_utils import upload_meter
+from profile_utils import profiles
+from metrics_utils import stage_seconds
+from extractor_utils import PROCESS_CONTEXT
+from log_utils import send_log
+from job_utils import user_jobs
 
 logger = logging.getLogger(__name__)
 
+# Media that is already compressed; deflating it again only burns CPU
+STORED_EXTENSIONS = {
+    '.mp4', '.mkv', '.webm', '.mov', '.mp3', '.m4a', '.opus', '.ogg',
+    '.aac', '.flac', '.jpg', '.jpeg', '.png', '.zip'
+}
+# Size of the independently deflated blocks handed to the process pool
+ZIP_CHUNK_SIZE = 4 * 1024 * 1024
+
+def _deflate_chunk(data, final):
+    """Deflate one chunk into a raw deflate fragment (runs in a worker process)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    # A sync flush ends the fragment on a byte boundary without marking the
+    # last block, so fragments can simply be concatenated in order
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+def _write_deflated_member(zipf, pool, file_path, arcname):
+    """Write a member whose chunks are deflated in parallel, preserving order"""
+    file_size = os.path.getsize(file_path)
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.file_size = file_size
+    zinfo.compress_size = 0
+    zinfo.CRC = 0
+    # Deflate can grow incompressible data slightly, so leave some headroom
+    zip64 = file_size * 1.05 > zipfile.ZIP64_LIMIT
+
+    fp = zipf.fp
+    zinfo.header_offset = fp.tell()
+    # Placeholder header, rewritten once CRC and compressed size are known
+    fp.write(zinfo.FileHeader(zip64))
+
+    crc = 0
+    compress_size = 0
+    pending = []
+    window = max(2, Config.ZIP_WORKERS * 2)
+    offset = 0
+
+    with open(file_path, 'rb') as src:
+        while True:
+            data = src.read(ZIP_CHUNK_SIZE)
+            offset += len(data)
+            final = offset >= file_size or not data
+            crc = zlib.crc32(data, crc)
+            pending.append(pool.submit(_deflate_chunk, data, final))
+
+            # Keep a bounded number of chunks in flight and write them in order
+            while len(pending) >= window or (final and pending):
+                block = pending.pop(0).result()
+                fp.write(block)
+                compress_size += len(block)
+
+            if final:
+                break
+
+    zinfo.CRC = crc
+    zinfo.compress_size = compress_size
+    end_offset = fp.tell()
+    fp.seek(zinfo.header_offset)
+    fp.write(zinfo.FileHeader(zip64))
+    fp.seek(end_offset)
+
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = end_offset
+    zipf._didModify = True
+
+def _build_zip(files, zip_filename):
+    """Build the zip archive, deflating compressible members across all cores"""
+    workers = max(1, Config.ZIP_WORKERS)
+    # Built from an executor thread, so the workers must not be forked from it
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=PROCESS_CONTEXT) if workers > 1 else None
+    try:
+        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for file in files:
+                if not os.path.exists(file):
+                    continue
+                # Add file to zip with just the basename to avoid folder structure in zip
+                arcname = os.path.basename(file)
+                extension = os.path.splitext(file)[1].lower()
+                if extension in STORED_EXTENSIONS:
+                    zipf.write(file, arcname, compress_type=zipfile.ZIP_STORED)
+                elif pool:
+                    _write_deflated_member(zipf, pool, file, arcname)
+                else:
+                    zipf.write(file, arcname)
+    finally:
+        if pool:
+            pool.shutdown()
+
 async def create_zip_file(files, user_id, playlist_title):
     """Create a zip file from a list of files"""
     try:
@@ -20,12 +116,10 @@ async def create_zip_file(files, user_id, playlist_title):
         safe_title = "".join([c if c.isalnum() or c in [' ', '-', '_'] else '_' for c in playlist_title])
         zip_filename = f"{zip_folder}/{safe_title}.zip"
         
-        # Create the zip file
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file in files:
-                if os.path.exists(file):
-                    # Add file to zip with just the basename to avoid folder structure in zip
-                    zipf.write(file, os.path.basename(file))
+        # Create the zip file off the event loop so the bot stays responsive
+        loop = asyncio.get_running_loop()
+        with stage_seconds.time(stage='zip'):
+            await loop.run_in_executor(None, _build_zip, files, zip_filename)
         
         return zip_filename
     except Exception as e:
@@ -66,6 +160,7 @@ async def upload_zip_to_telegram(app, user_id, zip_file, playlist_title, message
         
         # Delete progress message after upload
         await progress_message.delete()
+        upload_meter.record(os.path.getsize(zip_file), asyncio.get_event_loop().time() - start_time)
         await message.edit_text(
         f"✅ ZIP Upload completed!\n"
         f"Playlist: {playlist_title}"
@@ -76,13 +171,8 @@ async def upload_zip_to_telegram(app, user_id, zip_file, playlist_title, message
         
         # Send log message for successful upload
         try:
-            # Use the app instance passed to the function instead of importing it
-            user = await app.get_users(user_id)
-            user_mention = f"@{user.username}" if user.username else f"[{user.first_name}](tg://user?id={user_id})"
-            
-            # Import only what's needed
-            from main import user_data, send_log, active_processes
-            original_url = user_data.get(user_id, {}).get('url', 'Unknown URL')
+            user_mention = await profiles.mention(app, user_id)
+            original_url = user_jobs.current(user_id).url or 'Unknown URL'
             
             log_message = (
                 "#PlaylistBotLogs \n"
@@ -92,10 +182,7 @@ async def upload_zip_to_telegram(app, user_id, zip_file, playlist_title, message
                 f"📋 Playlist: {playlist_title}\n"
                 f"🔗 YouTube URL: {original_url}"
             )
-            await send_log(log_message)
-            
-            # Remove user from active processes
-            active_processes.pop(user_id, None)
+            send_log(log_message)
         except Exception as e:
             logger.error(f"Failed to send upload completion log: {str(e)}")
         
@@ -107,7 +194,7 @@ async def upload_zip_to_telegram(app, user_id, zip_file, playlist_title, message
         )
         return False
 
-async def upload_zip_to_gofile(zip_file, message, playlist_title, upload_to_gofile_func):
+async def upload_zip_to_gofile(app, zip_file, message, playlist_title, upload_to_gofile_func):
     """Upload a zip file to GoFile"""
     try:
         # Extract user_id from message
@@ -124,24 +211,18 @@ async def upload_zip_to_gofile(zip_file, message, playlist_title, upload_to_gofi
             )
             # Send log message for successful upload
             try:
-                # Import only what's needed, not the app
-                from main import send_log, active_processes, user_data
+                user_mention = await profiles.mention(app, user_id)
                 
-                # Pass the app instance to the function instead
-                # Modify the function signature in main.py to accept app parameter
                 log_message = (
                     "#PlaylistBotLogs \n"
                     f"✅ GoFile ZIP upload completed!\n"
-                    f"👤 User: ID {user_id}\n"
+                    f"👤 User: {user_mention}\n"
                     f"🆔 ID: `{user_id}`\n"
                     f"📋 Playlist: {playlist_title}\n"
-                    f"🔗 YouTube URL: {user_data.get(user_id, {}).get('url', 'Unknown URL')}\n"
+                    f"🔗 YouTube URL: {user_jobs.current(user_id).url or 'Unknown URL'}\n"
                     f"📥 GoFile Link: {result['downloadPage']}"
                 )
-                await send_log(log_message)
-                
-                # Remove user from active processes
-                active_processes.pop(user_id, None)
+                send_log(log_message)
             except Exception as e:
                 logger.error(f"Failed to send upload completion log: {str(e)}")
                 